@@ -1,4 +1,5 @@
 import os
+import sys
 import time
 import csv
 import glob
@@ -7,20 +8,17 @@ import re
 import datetime
 import ipaddress
 import shutil
-import pandas as pd
-import ipinfo
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from openpyxl import load_workbook, Workbook
-from openpyxl.styles import PatternFill
-from openpyxl.utils.dataframe import dataframe_to_rows
-from openpyxl.worksheet.table import Table, TableStyleInfo
-from openpyxl.utils import get_column_letter
+import json
+import bisect
+import tempfile
+import itertools
+from array import array
+import threading
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from ip_history import IPHistoryIndex
+from output_sinks import build_sinks, ExcelSink
+from firewall_session import get_session, close_session, close_all_sessions
 
 # ========== CONFIGURATION ==========
 WEBSITE_CREDENTIALS = {
@@ -30,156 +28,204 @@ WEBSITE_CREDENTIALS = {
 
 # ========== WEBSITE CONFIGURATION ==========
 BASE_URL = ""
-SNORT_BLOCKED_HOSTS_URL = BASE_URL + "snort/snort_blocked.php"
+SNORT_BLOCKED_HOSTS_PATH = "snort/snort_blocked.php"
+DOWNLOAD_TIMEOUT = 30  # seconds to wait for the blocked hosts archive to download
+
+# ========== MULTI-FIREWALL CONFIGURATION ==========
+# Leave empty to use BASE_URL/WEBSITE_CREDENTIALS above. Each firewall downloads into
+# its own DOWNLOAD_DIR/<name> folder and all of them are merged into one report.
+FIREWALLS = [
+    # {'name': 'fw1', 'base_url': 'https://10.0.0.1:8443/', 'username': '', 'password': ''},
+]
+FIREWALL_WORKERS = 4  # Firewalls collected at the same time
+
+# ========== WATCH MODE CONFIGURATION ==========
+WATCH_INTERVAL = 300  # seconds between polls when running with --watch
 
 # ========== PATH CONFIGURATION ==========
 DOWNLOAD_DIR = r""
 OUTPUT_DIR = r""
 
+# ========== ARCHIVE CONFIGURATION ==========
+ARCHIVE_WORKERS = None  # Processes used to parse per-interface files (None uses all cores)
+
 # ========== IPINFO CONFIGURATION ==========
 IPINFO_ACCESS_TOKEN = ''
 IPINFO_FIELDS = ['ip', 'org', 'country_name', 'hostname']
 
+# ========== CHECKPOINT CONFIGURATION ==========
+# Completed lookups are journaled to OUTPUT_DIR so an interrupted run can resume
+ENRICHMENT_MAX_RETRIES = 3
+ENRICHMENT_RETRY_BACKOFF = 2  # seconds, doubled after every failed retry round
+# Maximum ipinfo lookups per run, or per day in watch mode (None for unlimited). When set,
+# IPs with the most Snort alert hits are enriched first and the rest are deferred to the
+# next run (the next poll in watch mode, once the next day's budget starts).
+ENRICHMENT_MAX_LOOKUPS = None
+
+# ========== ENRICHMENT CONCURRENCY CONFIGURATION ==========
+# The number of lookups in flight adapts AIMD-style: it grows by about one per round of
+# fast successful lookups and is halved on 429/5xx responses or timeouts, after which
+# new lookups wait for the Retry-After the API sent
+ENRICHMENT_INITIAL_CONCURRENCY = 2
+ENRICHMENT_MIN_CONCURRENCY = 1
+ENRICHMENT_MAX_CONCURRENCY = 32
+ENRICHMENT_TARGET_LATENCY = 1.0  # seconds; slower lookups stop the limit from growing
+ENRICHMENT_DEFAULT_RETRY_AFTER = 5  # seconds to pause after a 429 without Retry-After
+# After this many 429s in a row the API quota is taken as used up: no more lookups are
+# sent and the remaining IPs are deferred to the next run (None to keep retrying)
+ENRICHMENT_QUOTA_BREAKER = 10
+ENRICHMENT_STATS_INTERVAL = 10  # seconds between limit/throughput log lines
+ENRICHMENT_THROUGHPUT_WINDOW = 30  # seconds of recent lookups the reported throughput covers
+
+# ========== OUTPUT CONFIGURATION ==========
+# Any of 'excel', 'csv', 'jsonl', 'parquet' (parquet needs pyarrow). Excel sheets that
+# reach the row limit continue on '<date>_2', '<date>_3', ...
+OUTPUT_FORMATS = ['excel']
+OUTPUT_BATCH_SIZE = 500  # Enriched rows handed to the sinks at a time
+
+# ========== AGGREGATED REPORT CONFIGURATION ==========
+# A '<date>_networks' sheet groups the day's new IPs by network prefix and by org
+AGGREGATE_REPORT = True
+AGGREGATE_PREFIX_LENGTH = 24  # IPv4 prefix length used to group addresses
+AGGREGATE_IPV6_PREFIX_LENGTH = 64
+AGGREGATE_MIN_COUNT = 4  # Networks with fewer new IPs are left out of the report
+AGGREGATE_SAMPLE_SIZE = 5  # Sample IPs listed per row
+
+# ========== TREND CONFIGURATION ==========
+# Daily rollups (blocked/new/removed totals, new IPs per org, country and highlight rule)
+# are kept in the IP history index and exported to this CSV in OUTPUT_DIR after each run
+TREND_SUMMARY_FILE = "trend_summary.csv"
+
+# ========== PASS LIST CONFIGURATION ==========
+# New IPs covered by the Snort Pass List are never enriched. The pass list of each firewall
+# is read from its Pass List page after the download and cached in OUTPUT_DIR (so a run that
+# cannot reach the firewall uses the last copy); an exported pfSense config.xml can be
+# given instead or in addition.
+PASSLIST_PATH = "snort/snort_passlist_edit.php?id=0"
+PASSLIST_REFRESH = True  # Set to False to only use the cached copy and PASSLIST_CONFIG_XML
+PASSLIST_CONFIG_XML = r""
+PASSLIST_ACTION = 'flag'  # 'flag' reports covered IPs with passlisted=yes, 'skip' leaves them out
+
+# ========== MEMORY CONFIGURATION ==========
+# Enrichment fields with few distinct values; their strings are shared between records
+CATEGORICAL_FIELDS = ['org', 'country_name']
+
 # ========== HIGHLIGHTING CONFIGURATION ==========
 HIGHLIGHT_ORGS = ["Microsoft Corporation", "Google LLC", "Amazon.com", "Akamai"]
 
+# ========== KNOWN RANGES CONFIGURATION ==========
+# Directory with the published IP range files of cloud/CDN providers (JSON or CSV).
+# Files are matched to an organization by filename prefix, e.g. "google_goog.json".
+# IPs inside these ranges are tagged with the organization without an ipinfo lookup.
+KNOWN_RANGES_DIR = r""
+KNOWN_RANGE_PROVIDERS = {
+    'google': "Google LLC",
+    'microsoft': "Microsoft Corporation",
+    'azure': "Microsoft Corporation",
+    'amazon': "Amazon.com",
+    'aws': "Amazon.com",
+    'akamai': "Akamai",
+}
+
+
+def wait_for_new_download(download_dir, existing_files, timeout=None):
+    """
+    Wait until a file that is not in existing_files has finished downloading to download_dir.
+    Returns its path, or None on timeout (DOWNLOAD_TIMEOUT by default).
+    """
+    deadline = time.time() + (timeout or DOWNLOAD_TIMEOUT)
+    while time.time() < deadline:
+        new_files = [
+            os.path.join(download_dir, f) for f in os.listdir(download_dir)
+            if f not in existing_files and not f.endswith(('.crdownload', '.tmp', '.part'))
+            and os.path.isfile(os.path.join(download_dir, f))
+        ]
+        if new_files:
+            return max(new_files, key=os.path.getctime)
+        time.sleep(0.5)
+    return None
+
 
-def setup_chrome_driver():
+def download_blocked_hosts(session, download_dir):
     """
-    Setup Chrome WebDriver with options to handle SSL and other configurations
+    Navigate to the Snort blocked hosts page with a FirewallSession (which logs in again
+    if needed) and download the archive to download_dir.
+    Returns the downloaded file path, or None if the page or download was not available.
     """
-    # Create download directory if it doesn't exist
-    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
     
-    # Chrome options
-    chrome_options = Options()
-    chrome_options.add_argument('--ignore-ssl-errors=yes')
-    chrome_options.add_argument('--ignore-certificate-errors')
+    # Navigate to Snort blocked hosts page
+    print("Navigating to Snort blocked hosts page...")
+    session.set_download_dir(download_dir)
+    driver = session.open(SNORT_BLOCKED_HOSTS_PATH)
     
-    # Set up download preferences
-    chrome_options.add_experimental_option("prefs", {
-        "download.default_directory": DOWNLOAD_DIR,
-        "download.prompt_for_download": False,
-        "download.directory_upgrade": True,
-        "safebrowsing.enabled": False
-    })
+    # Find and click the Download button
+    download_button_locators = [
+        (By.ID, "download"),
+        (By.NAME, "download"),
+        (By.XPATH, "//button[contains(text(), 'Download')]"),
+        (By.XPATH, "//button[@title='Download interface log files as a gzip archive']"),
+        (By.XPATH, "//button[contains(@class, 'btn-success') and @name='download']")
+    ]
     
-    # Reduce logging
-    chrome_options.add_argument('--log-level=3')
-    chrome_options.add_experimental_option('excludeSwitches', ['enable-logging'])
+    download_button = None
+    for locator in download_button_locators:
+        try:
+            download_button = WebDriverWait(driver, 5).until(
+                EC.element_to_be_clickable(locator)
+            )
+            break
+        except Exception:
+            continue
     
-    # Try to use WebDriverManager if installed
-    try:
-        from webdriver_manager.chrome import ChromeDriverManager
-        service = Service(ChromeDriverManager().install())
-    except ImportError:
-        # Fallback to manual path if WebDriverManager is not installed
-        service = Service(r"C:\path\to\chromedriver.exe")  # Replace with your actual path
+    if not download_button:
+        print("Download button not found")
+        
+        # Optional: Try to capture a screenshot to debug
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        screenshot_path = os.path.join(download_dir, f"debug_screenshot_{timestamp}.png")
+        driver.save_screenshot(screenshot_path)
+        print(f"Debug screenshot saved to: {screenshot_path}")
+        
+        return None
+    
+    existing_files = set(os.listdir(download_dir))
+    print("Download button found. Initiating download...")
+    download_button.click()
     
-    # Create and return the WebDriver
-    return webdriver.Chrome(service=service, options=chrome_options)
+    # Wait for the new archive to appear in the download directory
+    print("Waiting for download to complete...")
+    newest_file = wait_for_new_download(download_dir, existing_files)
+    
+    if newest_file:
+        print(f"Download completed: {os.path.basename(newest_file)}")
+        print(f"File saved to: {newest_file}")
+        return newest_file
+    else:
+        print("No downloaded files found")
+        return None
 
 
-def login_and_download_blocked_hosts(credentials):
+def login_and_download_blocked_hosts(credentials, base_url=None, download_dir=None):
     """
-    Login to the website, navigate to Snort blocked hosts page, and download the file
+    Login to the website (or reuse the shared session), navigate to Snort blocked hosts page,
+    and download the file. The browser session stays open for later steps of the same run.
     """
+    base_url = base_url or BASE_URL
+    download_dir = download_dir or DOWNLOAD_DIR
+    
     # Validate credentials
     if not credentials['username'] or not credentials['password']:
         print("Error: Username or password not set")
         return None
     
-    # Initialize the WebDriver
-    driver = setup_chrome_driver()
+    # Get the shared browser session of this firewall
+    session = get_session(base_url, credentials)
     
     try:
-        # Navigate to the website
-        print("Navigating to login page...")
-        driver.get(BASE_URL)
-        
-        # Find and interact with username field
-        username_field = WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.ID, "usernamefld"))
-        )
-        username_field.clear()
-        username_field.send_keys(credentials['username'])
-        
-        # Find and interact with password field
-        password_field = WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.ID, "passwordfld"))
-        )
-        password_field.clear()
-        password_field.send_keys(credentials['password'])
-        
-        # Find and click login button
-        login_button = WebDriverWait(driver, 10).until(
-            EC.element_to_be_clickable((By.CLASS_NAME, "btn-success"))
-        )
-        login_button.click()
-        
-        # Wait for login to complete
-        print("Logging in...")
-        time.sleep(3)
-        
-        # Navigate to Snort blocked hosts page
-        print("Navigating to Snort blocked hosts page...")
-        driver.get(SNORT_BLOCKED_HOSTS_URL)
-        
-        # Wait for the page to load
-        time.sleep(3)
-        
-        # Find and click the Download button
-        download_button_locators = [
-            (By.ID, "download"),
-            (By.NAME, "download"),
-            (By.XPATH, "//button[contains(text(), 'Download')]"),
-            (By.XPATH, "//button[@title='Download interface log files as a gzip archive']"),
-            (By.XPATH, "//button[contains(@class, 'btn-success') and @name='download']")
-        ]
-        
-        download_button = None
-        for locator in download_button_locators:
-            try:
-                download_button = WebDriverWait(driver, 5).until(
-                    EC.element_to_be_clickable(locator)
-                )
-                break
-            except Exception:
-                continue
-        
-        if download_button:
-            print("Download button found. Initiating download...")
-            download_button.click()
-            
-            # Wait for download to complete (adjust time as needed)
-            print("Waiting for download to complete...")
-            time.sleep(10)
-            
-            # Check if file exists in download directory
-            files = os.listdir(DOWNLOAD_DIR)
-            downloaded_files = [f for f in files if os.path.isfile(os.path.join(DOWNLOAD_DIR, f))]
-            
-            if downloaded_files:
-                newest_file = max(
-                    [os.path.join(DOWNLOAD_DIR, f) for f in downloaded_files],
-                    key=os.path.getctime
-                )
-                print(f"Download completed: {os.path.basename(newest_file)}")
-                print(f"File saved to: {newest_file}")
-                return newest_file
-            else:
-                print("No downloaded files found")
-                return None
-        else:
-            print("Download button not found")
-            
-            # Optional: Try to capture a screenshot to debug
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            screenshot_path = os.path.join(DOWNLOAD_DIR, f"debug_screenshot_{timestamp}.png")
-            driver.save_screenshot(screenshot_path)
-            print(f"Debug screenshot saved to: {screenshot_path}")
-            
-            return None
+        return download_blocked_hosts(session, download_dir)
     
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -187,19 +233,16 @@ def login_and_download_blocked_hosts(credentials):
         # Capture screenshot on error
         try:
             timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            screenshot_path = os.path.join(DOWNLOAD_DIR, f"error_screenshot_{timestamp}.png")
-            driver.save_screenshot(screenshot_path)
+            screenshot_path = os.path.join(download_dir, f"error_screenshot_{timestamp}.png")
+            session.driver.save_screenshot(screenshot_path)
             print(f"Error screenshot saved to: {screenshot_path}")
         except:
             pass
-            
+        
+        # Start over with a fresh browser and login next time
+        session.forget_cookies()
+        close_session(base_url, credentials)
         return None
-    
-    finally:
-        # Close the browser
-        print("Closing browser...")
-        if 'driver' in locals():
-            driver.quit()
 
 
 def find_latest_download(downloads_folder, pattern="snort_blocked_*.tar.gz"):
@@ -280,107 +323,317 @@ def cleanup_old_snort_files(downloads_folder, keep_latest=2, pattern="snort_bloc
     print(f"Cleanup complete. Kept {len(files_to_keep)} recent files, deleted {len(files_to_delete)} old files.")
 
 
-def extract_tar_gz(tar_gz_path, extract_dir):
-    """Extract the tar.gz file to get the snort_block.pf file"""
-    temp_dir = os.path.join(extract_dir, "temp_extract")
+def _is_alert_log(name):
+    """Return True if a file name looks like a Snort alert log"""
+    return name == 'alert' or name.startswith('alert.') or name.endswith('.alert')
+
+
+def _is_block_file(name):
+    """Return True if a file name looks like a per-interface blocked hosts file"""
+    return name.endswith('.pf') or 'block' in name
+
+
+def _is_nested_archive(name):
+    return name.endswith(('.tar', '.tar.gz', '.tgz'))
+
+
+def _interface_from_path(path):
+    """Derive the interface tag (e.g. 'em0') from a snort_<iface>... file or directory name"""
+    match = re.search(r'snort_([a-z]+\d+)', path.replace('\\', '/'))
+    if match:
+        return match.group(1)
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def ip_to_int(ip):
+    """Encode an IP address as an integer; IPv6 is offset above 2**128 so it never collides with IPv4"""
+    addr = ipaddress.ip_address(ip)
+    return int(addr) if addr.version == 4 else int(addr) + (1 << 128)
+
+
+def int_to_ip(value):
+    """Decode an integer produced by ip_to_int back to its string form"""
+    if value >= 1 << 128:
+        return str(ipaddress.IPv6Address(value - (1 << 128)))
+    return str(ipaddress.IPv4Address(value))
+
+
+def _parse_ip_lines(lines):
+    """Return the set of integer-encoded IPs found in an iterable of text lines"""
+    ip_ints = set()
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+            
+        try:
+            # Try to extract IP from line if it's not just a plain IP
+            ip_match = re.search(r'(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})', line)
+            if ip_match:
+                ip = ip_match.group(1)
+            else:
+                ip = line
+                
+            # Validate IP
+            ip_ints.add(ip_to_int(ip))
+        except ValueError:
+            # Skip lines that don't contain valid IPs
+            continue
+    return ip_ints
+
+
+_ALERT_TIME_PATTERN = re.compile(r'(\d{1,2})/(\d{1,2})(?:/(\d{2,4}))?-(\d{1,2}):(\d{2}):(\d{2}(?:\.\d+)?)')
+
+
+def alert_time_key(timestamp):
+    """
+    Sortable key for a Snort alert timestamp, MM/DD/YY-HH:MM:SS.ffffff (the year is
+    missing from "full" alerts unless Snort runs with -y). Plain string comparison would
+    put 01/02/25 before 12/31/24. Unparseable timestamps sort first.
+    """
+    match = _ALERT_TIME_PATTERN.match(timestamp or '')
+    if not match:
+        return ()
+    month, day, year, hour, minute, second = match.groups()
+    year = int(year) + (2000 if len(year) == 2 else 0) if year else 0
+    return (year, int(month), int(day), int(hour), int(minute), float(second))
+
+
+def _alert_endpoint(token, has_port):
+    """
+    IP address of a "full" alert endpoint: 1.2.3.4:80, [2001:db8::1]:80 or 2001:db8::1:80.
+    Snort leaves IPv6 addresses unbracketed, so has_port (a TCP/UDP alert) says whether
+    their last group is the port.
+    """
+    if token.startswith('['):
+        return token[1:].split(']', 1)[0]
+    if token.count(':') == 1 or (has_port and ':' in token):
+        return token.rsplit(':', 1)[0]
+    return token
+
+
+def _parse_alert_lines(lines, stats):
+    """
+    Count alert hits per IP address (IPv4 and IPv6) from Snort alert log lines into stats.
+    Both the CSV alert format used by pfSense and the "full" Snort alert format are parsed.
+    
+    Returns:
+        int: number of lines read
+    """
+    def record_hit(ip, signature, timestamp):
+        entry = stats.get(ip)
+        if entry is None:
+            entry = stats[ip] = {'hits': 0, 'signatures': set(), 'last_seen': '', 'last_seen_key': ()}
+        entry['hits'] += 1
+        if signature:
+            entry['signatures'].add(signature)
+        if timestamp:
+            key = alert_time_key(timestamp)
+            if key > entry['last_seen_key'] or not entry['last_seen']:
+                entry['last_seen'] = timestamp
+                entry['last_seen_key'] = key
     
-    # Create temp directory if it doesn't exist
-    os.makedirs(temp_dir, exist_ok=True)
+    full_sig_pattern = re.compile(r'\[\*\*\]\s*\[(\d+):(\d+):\d+\]')
+    full_addr_pattern = re.compile(r'^(\d{1,2}/\d{1,2}(?:/\d{2,4})?-[\d:.]+)\s+(\S+)\s+->\s+(\S+)$')
     
-    print(f"Extracting {tar_gz_path}...")
-    # List contents first to understand the file structure
-    with tarfile.open(tar_gz_path, "r:gz") as tar:
-        members = tar.getmembers()
-        print(f"Archive contains {len(members)} files")
+    count = 0
+    signature = ''
+    pending_addr = None  # full-format address line, waiting for the protocol line after it
+    for line in lines:
+        count += 1
+        line = line.strip()
+        if not line:
+            continue
+        
+        # "Full" alert format: a signature header line, then a timestamp/address line and a
+        # protocol line (TCP/UDP alerts have ports on the address line)
+        if pending_addr:
+            timestamp, src, dst, addr_signature = pending_addr
+            has_port = line.startswith(('TCP', 'UDP'))
+            record_hit(_alert_endpoint(src, has_port), addr_signature, timestamp)
+            record_hit(_alert_endpoint(dst, has_port), addr_signature, timestamp)
+            pending_addr = None
+        sig_match = full_sig_pattern.match(line)
+        if sig_match:
+            signature = f"{sig_match.group(1)}:{sig_match.group(2)}"
+            continue
+        addr_match = full_addr_pattern.match(line)
+        if addr_match:
+            pending_addr = addr_match.groups() + (signature,)
+            continue
         
-        # Debug: Print first few files to understand structure
-        for i, member in enumerate(members[:5]):
-            print(f"  - {member.name}")
+        # CSV format: timestamp,gid,sid,rev,msg,proto,src,srcport,dst,dstport,...
+        fields = next(csv.reader([line]))
+        if len(fields) >= 9 and fields[1].isdigit() and fields[2].isdigit():
+            signature = f"{fields[1]}:{fields[2]}"
+            record_hit(fields[6].strip(), signature, fields[0].strip())
+            record_hit(fields[8].strip(), signature, fields[0].strip())
+    if pending_addr:
+        timestamp, src, dst, addr_signature = pending_addr
+        record_hit(_alert_endpoint(src, True), addr_signature, timestamp)
+        record_hit(_alert_endpoint(dst, True), addr_signature, timestamp)
+    return count
+
+
+def merge_alert_stats(target, source):
+    """Merge per-IP alert stats from source into target"""
+    for ip, entry in source.items():
+        current = target.get(ip)
+        if current is None:
+            target[ip] = entry
+            continue
+        current['hits'] += entry['hits']
+        current['signatures'] |= entry['signatures']
+        if entry['last_seen_key'] > current['last_seen_key']:
+            current['last_seen'] = entry['last_seen']
+            current['last_seen_key'] = entry['last_seen_key']
+    return target
+
+
+def _iter_text_lines(binary_file):
+    for raw_line in binary_file:
+        yield raw_line.decode('utf-8', errors='replace')
+
+
+def _process_archive_file(path, archive_path):
+    """
+    Worker for the archive process pool: parse one extracted file, or every file of a
+    nested archive, into per-interface integer IP sets and alert stats. archive_path is
+    the file's path inside the archive, which the interface tag is taken from (the
+    extraction directory may itself contain a name like 'snort_data1').
+    
+    Returns:
+        list: ('block', interface, set of integer IPs) or ('alert', interface, alert stats, lines read)
+              per file
+    """
+    results = []
+    name = os.path.basename(path)
+    
+    if _is_nested_archive(name):
+        with tarfile.open(path, "r:*") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                member_name = os.path.basename(member.name)
+                interface = _interface_from_path(member.name)
+                if _is_alert_log(member_name):
+                    stats = {}
+                    with tar.extractfile(member) as f:
+                        lines = _parse_alert_lines(_iter_text_lines(f), stats)
+                    results.append(('alert', interface, stats, lines))
+                elif _is_block_file(member_name) or member_name.startswith('snort'):
+                    with tar.extractfile(member) as f:
+                        ip_ints = _parse_ip_lines(_iter_text_lines(f))
+                    results.append(('block', interface, ip_ints))
+        return results
+    
+    interface = _interface_from_path(archive_path)
+    with open(path, errors='replace') as f:
+        if _is_alert_log(name):
+            stats = {}
+            lines = _parse_alert_lines(f, stats)
+            results.append(('alert', interface, stats, lines))
+        else:
+            results.append(('block', interface, _parse_ip_lines(f)))
+    return results
+
+
+def extract_ip_snapshot(tar_gz_path, extract_dir, workers=None):
+    """
+    Extract the downloaded archive and parse every per-interface block file and alert
+    log in it (including nested archives) in parallel with a process pool.
+    
+    Returns:
+        tuple: (dict: ip -> comma-separated interfaces it is blocked on,
+                dict: ip -> alert stats {'hits', 'signatures', 'last_seen', 'last_seen_key'})
+    """
+    os.makedirs(extract_dir, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(prefix="temp_extract_", dir=extract_dir)
+    
+    try:
+        print(f"Extracting {tar_gz_path}...")
+        with tarfile.open(tar_gz_path, "r:gz") as tar:
+            members = tar.getmembers()
+            print(f"Archive contains {len(members)} files")
             
-        # Extract all files with filter='data' to address the deprecation warning
-        tar.extractall(path=temp_dir, filter='data')
-    
-    # Look for either .tar files or directly for .pf files
-    pf_files = glob.glob(os.path.join(temp_dir, "**", "*.pf"), recursive=True)
-    tar_files = glob.glob(os.path.join(temp_dir, "**", "*.tar"), recursive=True)
-    
-    if pf_files:
-        print(f"Found .pf file directly: {pf_files[0]}")
-        pf_file = pf_files[0]
-    elif tar_files:
-        print(f"Found .tar file, extracting: {tar_files[0]}")
-        with tarfile.open(tar_files[0], "r") as tar:
+            # Extract all files with filter='data' to address the deprecation warning
             tar.extractall(path=temp_dir, filter='data')
-        # Look for .pf files again after extracting the .tar
-        pf_files = glob.glob(os.path.join(temp_dir, "**", "*.pf"), recursive=True)
-        if not pf_files:
-            # If still no .pf files, try to find any text files that might contain IPs
-            possible_files = glob.glob(os.path.join(temp_dir, "**", "snort*"), recursive=True)
-            if possible_files:
-                pf_files = possible_files
-            else:
-                raise FileNotFoundError("No snort_block.pf or similar file found after extraction")
-        pf_file = pf_files[0]
-    else:
-        # If no .tar or .pf files, look for any file that might contain "snort" or "block"
-        possible_files = glob.glob(os.path.join(temp_dir, "**", "*snort*"), recursive=True) + \
-                         glob.glob(os.path.join(temp_dir, "**", "*block*"), recursive=True)
         
-        if not possible_files:
-            # List all extracted files for debugging
-            all_files = []
-            for root, dirs, files in os.walk(temp_dir):
-                for file in files:
-                    all_files.append(os.path.join(root, file))
-            
+        # Collect every block file, alert log and nested archive
+        tasks = []
+        snort_files = []
+        for root, dirs, files in os.walk(temp_dir):
+            for file in files:
+                if _is_nested_archive(file) or _is_alert_log(file) or _is_block_file(file):
+                    tasks.append(os.path.join(root, file))
+                elif file.startswith('snort'):
+                    snort_files.append(os.path.join(root, file))
+        
+        # Without .pf/block files, fall back to any file that might contain "snort"
+        if not any(_is_nested_archive(t) or _is_block_file(os.path.basename(t)) for t in tasks):
+            tasks += snort_files
+        
+        if not tasks:
             print("All extracted files:")
-            for file in all_files[:10]:  # Print first 10 files
-                print(f"  - {file}")
-                
-            raise FileNotFoundError("No .tar, .pf, or snort files found after extraction")
+            for root, dirs, files in os.walk(temp_dir):
+                for file in files[:10]:
+                    print(f"  - {os.path.join(root, file)}")
+            raise FileNotFoundError("No .tar, .pf, snort or alert files found after extraction")
         
-        print(f"Found possible snort/block file: {possible_files[0]}")
-        pf_file = possible_files[0]
-    
-    # Copy content to destination
-    target_file = os.path.join(extract_dir, "snort.txt")
-    with open(pf_file, 'r') as src, open(target_file, 'w') as dst:
-        content = src.read()
-        dst.write(content)
-        print(f"File contains {len(content.splitlines())} lines")
+        archive_paths = [os.path.relpath(task, temp_dir) for task in tasks]
+        workers = workers or ARCHIVE_WORKERS or os.cpu_count() or 1
+        workers = min(workers, len(tasks))
+        print(f"Parsing {len(tasks)} files with {workers} worker process(es)...")
+        
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = [r for task_results in pool.map(_process_archive_file, tasks, archive_paths)
+                           for r in task_results]
+        else:
+            results = [r for task, archive_path in zip(tasks, archive_paths)
+                       for r in _process_archive_file(task, archive_path)]
+    finally:
+        # Clean up temporary files
+        shutil.rmtree(temp_dir, ignore_errors=True)
     
-    print(f"Successfully extracted to {target_file}")
+    # Merge per-interface results into one de-duplicated snapshot
+    interfaces_by_ip = {}
+    alert_stats = {}
+    block_files = 0
+    for result in results:
+        if result[0] == 'alert':
+            kind, interface, stats, lines = result
+            merge_alert_stats(alert_stats, stats)
+            print(f"  - {interface}: {lines} alert log lines")
+        else:
+            kind, interface, ip_ints = result
+            block_files += 1
+            print(f"  - {interface}: {len(ip_ints)} blocked IPs")
+            for ip_int in ip_ints:
+                interfaces_by_ip.setdefault(ip_int, set()).add(interface)
     
-    # Clean up temporary files
-    shutil.rmtree(temp_dir)
+    if not block_files:
+        raise FileNotFoundError("No snort_block.pf or similar file found after extraction")
     
-    return target_file
+    snapshot = {int_to_ip(ip_int): ",".join(sorted(ifaces)) for ip_int, ifaces in interfaces_by_ip.items()}
+    print(f"Snapshot contains {len(snapshot)} unique blocked IPs from {block_files} block files")
+    return snapshot, alert_stats
+
+
+def add_alert_columns(data_list, alert_stats):
+    """Add hits, signatures and last_alert columns to each record"""
+    for record in data_list:
+        entry = alert_stats.get(record['ip'])
+        record['hits'] = entry['hits'] if entry else 0
+        record['signatures'] = len(entry['signatures']) if entry else 0
+        record['last_alert'] = entry['last_seen'] if entry else ''
 
 
 def extract_ip_set_from_file(file_path):
     """Extract IP addresses from a file and return as a set"""
-    ip_set = set()
     try:
         with open(file_path) as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                    
-                try:
-                    # Try to extract IP from line if it's not just a plain IP
-                    ip_match = re.search(r'(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})', line)
-                    if ip_match:
-                        ip = ip_match.group(1)
-                    else:
-                        ip = line
-                        
-                    # Validate IP
-                    ip = str(ipaddress.ip_address(ip))
-                    ip_set.add(ip)
-                except ValueError:
-                    # Skip lines that don't contain valid IPs
-                    continue
+            ip_set = {int_to_ip(ip_int) for ip_int in _parse_ip_lines(f)}
         
         print(f"Extracted {len(ip_set)} unique IP addresses from {file_path}")
         return ip_set
@@ -403,6 +656,15 @@ def compare_ip_files(today_file, previous_file):
     today_ips = extract_ip_set_from_file(today_file)
     previous_ips = extract_ip_set_from_file(previous_file)
     
+    return compare_ip_sets(today_ips, previous_ips)
+
+
+def compare_ip_sets(today_ips, previous_ips):
+    """Return the set of IPs in today_ips that are not in previous_ips (None means no previous snapshot)"""
+    if previous_ips is None:
+        print("No previous file available for comparison. Processing all IPs in current file.")
+        return set(today_ips)
+    
     # Find IPs that are in today's file but not in previous file
     new_ips = today_ips - previous_ips
     
@@ -412,103 +674,1023 @@ def compare_ip_files(today_file, previous_file):
     return new_ips
 
 
-def process_ip_addresses_from_set(ip_set, output_dir, master_xlsx_path, sheet_name):
-    """Process a set of IP addresses and add them to an Excel workbook"""
-    if not ip_set:
-        print("No IP addresses to process.")
-        return False
+class IPRangeIndex:
+    """
+    Sorted interval index of IP networks mapped to a label.
+    Lookups are a binary search over the merged range starts, O(log n) per address.
+    """
+    
+    def __init__(self):
+        self._ranges = {4: [], 6: []}
+        self._starts = {4: [], 6: []}
+    
+    def add(self, network, label):
+        """Add a network (string or ip_network) with its label; call build() when done"""
+        net = ipaddress.ip_network(network, strict=False)
+        self._ranges[net.version].append(
+            (int(net.network_address), int(net.broadcast_address), label)
+        )
+    
+    def build(self):
+        """Sort and merge overlapping ranges so each address maps to a single range"""
+        for version, ranges in self._ranges.items():
+            ranges.sort()
+            merged = []
+            for start, end, label in ranges:
+                if merged and start <= merged[-1][1] + 1 and label == merged[-1][2]:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], end), label)
+                elif merged and start <= merged[-1][1]:
+                    # Overlap with a different label: the earlier range wins
+                    if end > merged[-1][1]:
+                        merged.append((merged[-1][1] + 1, end, label))
+                else:
+                    merged.append((start, end, label))
+            self._ranges[version] = merged
+            self._starts[version] = [r[0] for r in merged]
+        return self
+    
+    def lookup(self, ip):
+        """Return the label of the range containing ip, or None"""
+        addr = ipaddress.ip_address(ip)
+        value = int(addr)
+        pos = bisect.bisect_right(self._starts[addr.version], value) - 1
+        if pos >= 0:
+            start, end, label = self._ranges[addr.version][pos]
+            if value <= end:
+                return label
+        return None
+    
+    def __len__(self):
+        return sum(len(r) for r in self._ranges.values())
+
+
+def _iter_networks_from_json(node):
+    """Yield every string in a JSON document that parses as an IP network"""
+    if isinstance(node, dict):
+        for value in node.values():
+            yield from _iter_networks_from_json(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _iter_networks_from_json(value)
+    elif isinstance(node, str) and ('/' in node or ':' in node or '.' in node):
+        try:
+            yield ipaddress.ip_network(node.strip(), strict=False)
+        except ValueError:
+            pass
+
+
+def _iter_networks_from_csv(file_path):
+    """Yield every CSV cell that parses as an IP network"""
+    with open(file_path, newline='') as f:
+        for row in csv.reader(f):
+            for cell in row:
+                try:
+                    yield ipaddress.ip_network(cell.strip(), strict=False)
+                except ValueError:
+                    continue
+
+
+def load_known_ranges(ranges_dir, providers=None):
+    """
+    Load published provider range files (JSON/CSV) from ranges_dir into an IPRangeIndex.
+    Each file is assigned to the organization whose key in providers prefixes its filename.
+    
+    Returns:
+        IPRangeIndex or None if no range files are configured or found
+    """
+    providers = KNOWN_RANGE_PROVIDERS if providers is None else providers
+    if not ranges_dir or not os.path.isdir(ranges_dir):
+        return None
+    
+    index = IPRangeIndex()
+    for file_path in sorted(glob.glob(os.path.join(ranges_dir, "*"))):
+        file_name = os.path.basename(file_path).lower()
+        org = next((o for key, o in providers.items() if file_name.startswith(key)), None)
+        if not org:
+            continue
         
-    print(f"Processing {len(ip_set)} IP addresses")
+        try:
+            if file_name.endswith('.json'):
+                with open(file_path) as f:
+                    networks = list(_iter_networks_from_json(json.load(f)))
+            elif file_name.endswith('.csv'):
+                networks = list(_iter_networks_from_csv(file_path))
+            else:
+                continue
+        except Exception as e:
+            print(f"Error reading range file {file_path}: {e}")
+            continue
+        
+        for net in networks:
+            index.add(net, org)
+        print(f"Loaded {len(networks)} ranges for {org} from {os.path.basename(file_path)}")
     
-    # === Fetch Data ===
-    handler = ipinfo.getHandler(IPINFO_ACCESS_TOKEN)
-    data_list = []
+    if not len(index):
+        print(f"No known provider ranges found in {ranges_dir}")
+        return None
+    
+    return index.build()
+
+
+def tag_known_range_ips(ip_set, range_index):
+    """
+    Split ip_set into IPs inside a known provider range and the rest.
+    
+    Returns:
+        tuple: (list: records with 'org' filled from the range index, set: IPs still needing enrichment)
+    """
+    if range_index is None:
+        return [], set(ip_set)
+    
+    tagged = []
+    remaining = set()
     for ip in ip_set:
+        org = range_index.lookup(ip)
+        if org:
+            record = {field: '' for field in IPINFO_FIELDS}
+            record['ip'] = ip
+            record['org'] = org
+            tagged.append(record)
+        else:
+            remaining.add(ip)
+    
+    print(f"Tagged {len(tagged)} IPs from known provider ranges, {len(remaining)} need enrichment")
+    return tagged, remaining
+
+
+def get_passlist_cache_path(firewall_name):
+    """Return the path of the cached pass list of a firewall"""
+    suffix = f"_{firewall_name}" if firewall_name else ""
+    return os.path.join(OUTPUT_DIR, f"passlist_cache{suffix}.txt")
+
+
+def read_passlist_from_firewall(session):
+    """Return the addresses on the Pass List page of a logged-in FirewallSession"""
+    from selenium.webdriver.common.by import By
+    
+    driver = session.open(PASSLIST_PATH)
+    fields = driver.find_elements(By.CSS_SELECTOR, "input[name^='address']")
+    return [value.strip() for value in (field.get_attribute('value') for field in fields) if value and value.strip()]
+
+
+def refresh_passlist_cache(firewall):
+    """
+    Read the pass list of a firewall through its shared browser session and save it to the
+    cache file. On failure, or when the read finds no entries while a cached copy exists
+    (e.g. after a change to the pass list page), the previous cached copy is kept.
+    """
+    label = firewall['name'] or firewall['base_url']
+    cache_path = get_passlist_cache_path(firewall['name'])
+    try:
+        session = get_session(firewall['base_url'], firewall['credentials'])
+        entries = read_passlist_from_firewall(session)
+    except Exception as e:
+        print(f"[{label}] Could not read the pass list, using the cached copy: {e}")
+        return False
+    
+    if not entries and os.path.exists(cache_path):
+        print(f"[{label}] Warning: the pass list read returned no entries, keeping the cached copy")
+        return False
+    
+    with open(cache_path, 'w') as f:
+        f.writelines(f"{entry}\n" for entry in entries)
+    print(f"[{label}] Cached {len(entries)} pass list entries")
+    return True
+
+
+def read_passlist_from_config_xml(config_xml_path):
+    """Return the addresses of every Snort pass list in an exported pfSense config.xml"""
+    import xml.etree.ElementTree as ET
+    
+    entries = []
+    for address in ET.parse(config_xml_path).getroot().iterfind('.//snortglobal/whitelist/item/address'):
+        entries += (address.text or '').split()
+    return entries
+
+
+def load_passlist(firewalls):
+    """
+    Build an IPRangeIndex of the cached pass lists of firewalls and of PASSLIST_CONFIG_XML.
+    Entries that are not addresses or networks (e.g. alias names) are skipped.
+    
+    Returns:
+        IPRangeIndex or None if there are no pass list entries
+    """
+    entries = []
+    for firewall in firewalls:
+        cache_path = get_passlist_cache_path(firewall['name'])
+        if os.path.exists(cache_path):
+            with open(cache_path) as f:
+                entries += [line.strip() for line in f if line.strip()]
+    if PASSLIST_CONFIG_XML and os.path.exists(PASSLIST_CONFIG_XML):
+        entries += read_passlist_from_config_xml(PASSLIST_CONFIG_XML)
+    
+    index = IPRangeIndex()
+    skipped = 0
+    for entry in entries:
         try:
-            details = handler.getDetails(ip, timeout=5)
-            data = details.all
-            filtered = {field: data.get(field, '') for field in IPINFO_FIELDS}
-            data_list.append(filtered)
-            print(f"Retrieved information for IP: {ip}")
-        except Exception as e:
-            print(f"Error fetching info for {ip}: {e}")
-            # Add the IP with empty values for other fields
-            filtered = {field: '' for field in IPINFO_FIELDS}
-            filtered['ip'] = ip
-            data_list.append(filtered)
-        time.sleep(1)  # Respect API rate limits
-
-    df = pd.DataFrame(data_list)
-    
-    # === Load existing workbook or create new one ===
-    if not os.path.exists(master_xlsx_path):
-        wb = Workbook()
-        # Remove default sheet
-        if 'Sheet' in wb.sheetnames:
-            del wb['Sheet']
-        wb.save(master_xlsx_path)
-        print(f"Created new master file: {master_xlsx_path}")
-    else:
-        wb = load_workbook(master_xlsx_path)
+            index.add(entry, 'passlist')
+        except ValueError:
+            skipped += 1
+    if not len(index):
+        return None
+    
+    index.build()
+    print(f"Loaded {len(index)} pass list ranges ({skipped} non-address entries skipped)")
+    return index
+
+
+def split_passlisted_ips(ip_set, passlist):
+    """
+    Split ip_set into IPs covered by the pass list (an IPRangeIndex) and the rest,
+    with one O(log n) lookup per address.
+    
+    Returns:
+        tuple: (set: passlisted IPs, set: remaining IPs)
+    """
+    if passlist is None:
+        return set(), set(ip_set)
+    
+    covered = {ip for ip in ip_set if passlist.lookup(ip)}
+    if covered:
+        print(f"{len(covered)} new IPs are already on the pass list and will not be enriched")
+    return covered, set(ip_set) - covered
 
-    # Remove sheet if it already exists (optional)
-    if sheet_name in wb.sheetnames:
-        del wb[sheet_name]
 
-    ws = wb.create_sheet(title=sheet_name)
+def get_journal_path(output_dir, sheet_name):
+    """Return the path of the enrichment checkpoint journal for a given sheet"""
+    return os.path.join(output_dir, f"enrichment_journal_{sheet_name}.jsonl")
 
-    # === Write DataFrame to worksheet ===
-    for r in dataframe_to_rows(df, index=False, header=True):
-        ws.append(r)
 
-    # === Auto-fit column widths ===
-    for column_cells in ws.columns:
-        max_length = 0
-        column_letter = get_column_letter(column_cells[0].column)
-        for cell in column_cells:
+def load_enrichment_journal(journal_path):
+    """
+    Load the checkpoint journal and return a dict of ip -> latest record.
+    A record has 'status' ('ok', 'failed', 'queued' for IPs not looked up yet,
+    'deferred' for IPs left over by ENRICHMENT_MAX_LOOKUPS, 'tagged' for IPs in a known
+    provider range or 'passlisted') and, for completed lookups and tagged IPs, 'data'.
+    """
+    records = {}
+    if not os.path.exists(journal_path):
+        return records
+    
+    with open(journal_path) as f:
+        for line in f:
             try:
-                if cell.value:
-                    max_length = max(max_length, len(str(cell.value)))
-            except:
-                pass
-        ws.column_dimensions[column_letter].width = max_length + 2
-
-    # === Highlight rows for selected organizations ===
-    red_fill = PatternFill(start_color='FFFF0000', end_color='FFFF0000', fill_type='solid')
-
-    org_col_index = None
-    for idx, cell in enumerate(ws[1], start=1):
-        if cell.value == 'org':
-            org_col_index = idx
-            break
+                record = json.loads(line)
+                if 'data' in record:
+                    intern_record(record['data'])
+                records[record['ip']] = record
+            except (ValueError, KeyError):
+                # Skip a partially written line left by a crash
+                continue
+    
+    statuses = Counter(r['status'] for r in records.values())
+    print(f"Loaded checkpoint journal {journal_path}: {statuses['ok']} completed, "
+          f"{statuses['failed']} failed, {statuses['deferred']} deferred, "
+          f"{statuses['queued']} not looked up yet, "
+          f"{statuses['tagged'] + statuses['passlisted']} known range/pass list")
+    return records
+
+
+def get_journal_ips(output_dir, sheet_name, statuses=None):
+    """
+    Return the IPs recorded in the checkpoint journal of a sheet (only those with one of
+    statuses, if given). A run that rewrites the sheet adds them all to its new IPs, so the
+    IPs of an earlier run today that crashed or left lookups unfinished are still reported
+    (and looked up) even though they no longer differ from the previous archive.
+    """
+    records = load_enrichment_journal(get_journal_path(output_dir, sheet_name))
+    return {ip for ip, r in records.items() if statuses is None or r['status'] in statuses}
+
+
+def open_journal(journal_path):
+    """
+    Open the journal for appending. If a crash left a partly written last line, it is
+    terminated first so the next record starts on a line of its own instead of being
+    skipped together with it.
+    """
+    torn = False
+    if os.path.exists(journal_path) and os.path.getsize(journal_path):
+        with open(journal_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            torn = f.read(1) != b"\n"
+    
+    journal = open(journal_path, 'a')
+    if torn:
+        journal.write("\n")
+    return journal
+
+
+def append_journal_record(journal, record):
+    """Append one record to the open journal file and force it to disk"""
+    journal.write(json.dumps(record) + "\n")
+    journal.flush()
+    os.fsync(journal.fileno())
+
+
+def append_journal_records(journal_path, records):
+    """Append many records to the journal with a single write to disk"""
+    if not records:
+        return
+    with open_journal(journal_path) as journal:
+        journal.writelines(json.dumps(record) + "\n" for record in records)
+        journal.flush()
+        os.fsync(journal.fileno())
+
+
+def cleanup_old_journals(output_dir, keep_sheet_name):
+    """Delete checkpoint journals left over from previous days"""
+    for journal_path in glob.glob(os.path.join(output_dir, "enrichment_journal_*.jsonl")):
+        if journal_path == get_journal_path(output_dir, keep_sheet_name):
+            continue
+        try:
+            os.remove(journal_path)
+            print(f"Deleted old journal: {os.path.basename(journal_path)}")
+        except Exception as e:
+            print(f"Error deleting journal {journal_path}: {e}")
+
+
+def intern_record(record):
+    """Share one string object per distinct CATEGORICAL_FIELDS value across all records"""
+    for field in CATEGORICAL_FIELDS:
+        value = record.get(field)
+        if isinstance(value, str):
+            record[field] = sys.intern(value)
+    return record
+
+
+def fetch_ip_details(handler, ip):
+    """Look up a single IP address and return only the configured fields"""
+    details = handler.getDetails(ip, timeout=5)
+    data = details.all
+    return intern_record({field: data.get(field, '') for field in IPINFO_FIELDS})
+
+
+class EnrichmentLimiter:
+    """
+    AIMD limit on concurrent ipinfo lookups. Successful lookups faster than
+    ENRICHMENT_TARGET_LATENCY add 1/limit (about +1 per round of lookups); throttling,
+    server errors and timeouts halve the limit at most once per round and 429s pause new
+    lookups for the Retry-After period. quota_exhausted() turns True after
+    ENRICHMENT_QUOTA_BREAKER 429s in a row. limit, throughput() and stats() can be read at any time.
+    """
+    
+    def __init__(self, initial=None, minimum=None, maximum=None, target_latency=None):
+        self.minimum = minimum or ENRICHMENT_MIN_CONCURRENCY
+        self.maximum = maximum or ENRICHMENT_MAX_CONCURRENCY
+        self.target_latency = target_latency or ENRICHMENT_TARGET_LATENCY
+        self.limit = float(min(self.maximum, max(self.minimum, initial or ENRICHMENT_INITIAL_CONCURRENCY)))
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.latency = None  # moving average in seconds
+        self.started = time.time()
+        self.recent = deque()  # completion times within ENRICHMENT_THROUGHPUT_WINDOW
+        self.completed = 0
+        self.errors = 0
+        self.throttled = 0
+        self.consecutive_throttled = 0
+        self.last_report = time.time()
+    
+    def in_flight_limit(self):
+        return max(self.minimum, int(self.limit))
+    
+    def wait(self):
+        """Sleep while a Retry-After pause is in effect"""
+        delay = self.paused_until - time.time()
+        if delay > 0:
+            time.sleep(delay)
+    
+    def begin(self):
+        """
+        Start a new enrichment call with this limiter (watch mode keeps one across polls):
+        the throughput window restarts so idle time between polls does not count, and a
+        quota breaker tripped on the previous call gets another chance
+        """
+        self.started = time.time()
+        self.recent.clear()
+        self.consecutive_throttled = 0
+    
+    def on_success(self, latency):
+        self.completed += 1
+        self.recent.append(time.time())
+        self.consecutive_throttled = 0
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        if latency <= self.target_latency:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+    
+    def on_error(self, congestion, retry_after=None):
+        """Record a failed lookup; congestion (429, 5xx, timeout) cuts the limit back"""
+        self.errors += 1
+        if not congestion:
+            return
+        now = time.time()
+        if retry_after is not None:
+            self.throttled += 1
+            self.consecutive_throttled += 1
+            self.paused_until = max(self.paused_until, now + retry_after)
+        # Halve at most once per round trip so a burst of errors is one congestion signal
+        if now - self.last_decrease > (self.latency or self.target_latency):
+            self.limit = max(self.minimum, self.limit / 2)
+            self.last_decrease = now
+    
+    def lookups(self):
+        """API calls made so far, successful or not (retries included)"""
+        return self.completed + self.errors
+    
+    def quota_exhausted(self):
+        """True once ENRICHMENT_QUOTA_BREAKER lookups in a row were answered with 429"""
+        return bool(ENRICHMENT_QUOTA_BREAKER) and self.consecutive_throttled >= ENRICHMENT_QUOTA_BREAKER
+    
+    def throughput(self):
+        """Successful lookups per second over the last ENRICHMENT_THROUGHPUT_WINDOW seconds"""
+        now = time.time()
+        while self.recent and self.recent[0] < now - ENRICHMENT_THROUGHPUT_WINDOW:
+            self.recent.popleft()
+        elapsed = min(ENRICHMENT_THROUGHPUT_WINDOW, now - self.started)
+        return len(self.recent) / elapsed if elapsed > 0 else 0.0
+    
+    def stats(self):
+        return {
+            'limit': self.in_flight_limit(),
+            'throughput': round(self.throughput(), 2),
+            'latency': round(self.latency or 0.0, 3),
+            'completed': self.completed,
+            'errors': self.errors,
+            'throttled': self.throttled,
+        }
+    
+    def report(self, force=False):
+        """Print the current limit and throughput every ENRICHMENT_STATS_INTERVAL seconds"""
+        if force or time.time() - self.last_report >= ENRICHMENT_STATS_INTERVAL:
+            self.last_report = time.time()
+            print("Enrichment: " + ", ".join(f"{key} {value}" for key, value in self.stats().items()))
+
+
+def _retry_after_seconds(response):
+    """Parse the Retry-After header of a response (seconds or HTTP date), or None"""
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return int(value)
+    try:
+        from email.utils import parsedate_to_datetime
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
 
-    if org_col_index:
-        for row in ws.iter_rows(min_row=2, max_row=ws.max_row):
-            org_cell = row[org_col_index - 1]
-            if org_cell.value:
-                for target_org in HIGHLIGHT_ORGS:
-                    if target_org in org_cell.value:
-                        for cell in row:
-                            cell.fill = red_fill
-                        break
-
-    # === Add Excel Table Style with Unique Table Name ===
-    if ws.max_row > 1:  # Only add table if there's data
-        table_ref = f"A1:{get_column_letter(ws.max_column)}{ws.max_row}"
-        table_name = f"IPData_{sheet_name.replace('-', '_').replace(':', '_')}"  # Safe table name
-        table = Table(displayName=table_name, ref=table_ref)
-        table.tableStyleInfo = TableStyleInfo(
-            name="TableStyleMedium6",
-            showFirstColumn=False,
-            showLastColumn=False,
-            showRowStripes=True,
-            showColumnStripes=False
+def _timed_lookup(local, ip):
+    """
+    Worker for the enrichment thread pool: look up ip with this thread's ipinfo handler.
+    
+    Returns:
+        tuple: (record or None, latency in seconds, error or None, congestion, retry_after)
+    """
+    import ipinfo
+    import requests
+    from ipinfo.exceptions import RequestQuotaExceededError
+    from ipinfo.error import APIError
+    
+    handler = getattr(local, 'handler', None)
+    if handler is None:
+        # Keep the last HTTP response of this thread so 429 headers can be read
+        def remember_response(response, *args, **kwargs):
+            local.response = response
+        handler = local.handler = ipinfo.getHandler(
+            IPINFO_ACCESS_TOKEN, request_options={'hooks': {'response': remember_response}}
         )
-        ws.add_table(table)
+    
+    local.response = None
+    start = time.time()
+    try:
+        record = fetch_ip_details(handler, ip)
+        return record, time.time() - start, None, False, None
+    except RequestQuotaExceededError as e:
+        retry_after = _retry_after_seconds(local.response)
+        return None, time.time() - start, e, True, ENRICHMENT_DEFAULT_RETRY_AFTER if retry_after is None else retry_after
+    except APIError as e:
+        return None, time.time() - start, e, e.error_code >= 500, None
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+        return None, time.time() - start, e, True, None
+    except Exception as e:
+        return None, time.time() - start, e, False, None
+
+
+def iter_enriched_ip_addresses(ip_set, journal_path, priority=None, max_lookups=None, cache=None,
+                               limiter=None, emit_deferred=True):
+    """
+    Enrich a set of IP addresses with ipinfo data, resuming from the checkpoint journal,
+    and yield each record as soon as it is available.
+    IPs already completed in the journal are not looked up again; failed lookups are
+    queued and retried with exponential backoff.
+    
+    Args:
+        priority: Optional dict of ip -> score; higher scores are looked up first
+        max_lookups: Optional cap on API calls for this run; IPs beyond it are deferred
+        cache: Optional in-memory dict of ip -> record kept between calls (watch mode);
+               once populated, the journal is not re-read
+        limiter: Optional EnrichmentLimiter to reuse (and inspect) across calls
+        emit_deferred: Yield empty rows for IPs deferred by max_lookups; watch mode turns
+                       this off and looks them up on a later poll instead
+    
+    Yields:
+        dict: IPINFO_FIELDS for each IP (empty fields for lookups that never succeeded)
+    """
+    if cache:
+        records = {}
+        completed = {ip: cache[ip] for ip in ip_set if ip in cache}
+    else:
+        records = load_enrichment_journal(journal_path)
+        if cache is not None:
+            cache.update((ip, r['data']) for ip, r in records.items() if r['status'] == 'ok')
+        completed = {ip: r['data'] for ip, r in records.items() if r['status'] == 'ok' and ip in ip_set}
+    pending = [ip for ip in ip_set if ip not in completed]
+    if priority:
+        pending.sort(key=lambda ip: priority.get(ip, 0), reverse=True)
+    
+    if completed:
+        print(f"Resuming from checkpoint: {len(completed)} IPs already enriched, {len(pending)} remaining")
+    
+    # Queue the remaining IPs in the journal first, so a rerun after a crash still has them
+    append_journal_records(journal_path, [{'ip': ip, 'status': 'queued'} for ip in pending if ip not in records])
+    
+    yield from completed.values()
+    
+    limiter = limiter or EnrichmentLimiter()
+    limiter.begin()
+    local = threading.local()
+    backoff = ENRICHMENT_RETRY_BACKOFF
+    lookups_left = max_lookups
+    deferred = []
+    
+    with open_journal(journal_path) as journal:
+        for attempt in range(ENRICHMENT_MAX_RETRIES + 1):
+            if not pending:
+                break
+            if lookups_left is not None and lookups_left <= 0:
+                # Budget spent (e.g. by earlier polls today): defer instead of reporting failures
+                deferred += pending
+                pending = []
+                break
+            if attempt > 0:
+                print(f"Retrying {len(pending)} failed lookups in {backoff} seconds "
+                      f"(retry {attempt}/{ENRICHMENT_MAX_RETRIES})...")
+                time.sleep(max(backoff, limiter.paused_until - time.time()))
+                backoff *= 2
+            
+            if lookups_left is not None and len(pending) > lookups_left:
+                deferred += pending[lookups_left:]
+                pending = pending[:lookups_left]
+            
+            failed = []
+            queue = deque(pending)
+            in_flight = {}
+            with ThreadPoolExecutor(max_workers=limiter.maximum) as executor:
+                while queue or in_flight:
+                    # === Stop sending lookups once the API quota is used up ===
+                    if queue and limiter.quota_exhausted():
+                        deferred += queue
+                        queue.clear()
+                    
+                    # === Keep up to the adaptive limit of lookups in flight ===
+                    while queue and len(in_flight) < limiter.in_flight_limit():
+                        limiter.wait()
+                        ip = queue.popleft()
+                        if lookups_left is not None:
+                            lookups_left -= 1
+                        in_flight[executor.submit(_timed_lookup, local, ip)] = ip
+                    
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        ip = in_flight.pop(future)
+                        filtered, latency, error, congestion, retry_after = future.result()
+                        if error is None:
+                            limiter.on_success(latency)
+                            if cache is not None:
+                                cache[ip] = filtered
+                            append_journal_record(journal, {'ip': ip, 'status': 'ok', 'data': filtered})
+                            print(f"Retrieved information for IP: {ip}")
+                            yield filtered
+                        else:
+                            limiter.on_error(congestion, retry_after)
+                            message = str(error) or type(error).__name__
+                            print(f"Error fetching info for {ip}: {message}")
+                            failed.append(ip)
+                            append_journal_record(journal, {'ip': ip, 'status': 'failed', 'error': message})
+                    limiter.report()
+            pending = failed
+            
+            if limiter.quota_exhausted():
+                # Retrying behind Retry-After pauses would make the rest of the run serial
+                print(f"ipinfo answered {limiter.consecutive_throttled} lookups in a row with 429; "
+                      f"the API quota looks used up, stopping lookups for this run")
+                deferred += pending
+                pending = []
+                break
+    
+    if limiter.completed or limiter.errors:
+        limiter.report(force=True)
+    
+    if deferred:
+        # Mark them in the journal, which the next run today reads to pick them up again
+        append_journal_records(journal_path, [{'ip': ip, 'status': 'deferred'} for ip in deferred])
+        print(f"Lookup quota reached: {len(deferred)} IPs deferred to the next run today")
+        if not emit_deferred:
+            deferred = []
+    if pending:
+        print(f"{len(pending)} lookups still failing; they will be retried on the next run today")
+    
+    for ip in pending + deferred:
+        # Add the IP with empty values for other fields
+        filtered = {field: '' for field in IPINFO_FIELDS}
+        filtered['ip'] = ip
+        yield filtered
+
+
+def add_history_columns(data_list, history):
+    """Add first_seen and days_seen from the IP history index to each record"""
+    seen = history.lookup_many([record['ip'] for record in data_list])
+    for record in data_list:
+        first_seen, days_seen = seen.get(record['ip'], ('', 0))
+        record['first_seen'] = first_seen
+        record['days_seen'] = days_seen
+
+
+def iter_batches(iterable, size):
+    """Yield lists of up to size items from iterable"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class IPColumn:
+    """
+    Append-only column of IP addresses packed into one bytearray (a version byte and
+    16 address bytes per IP) instead of a list of strings. Indexing and iteration
+    return the address strings.
+    """
+    
+    WIDTH = 17
+    
+    def __init__(self):
+        self.data = bytearray()
+    
+    def append(self, ip):
+        address = ipaddress.ip_address(ip)
+        self.data.append(address.version)
+        self.data += address.packed.rjust(16, b'\0')
+    
+    def __len__(self):
+        return len(self.data) // self.WIDTH
+    
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        start = i * self.WIDTH
+        if not 0 <= start < len(self.data):
+            raise IndexError(i)
+        if self.data[start] == 4:
+            return str(ipaddress.IPv4Address(bytes(self.data[start + 13:start + 17])))
+        return str(ipaddress.IPv6Address(bytes(self.data[start + 1:start + 17])))
+    
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class CategoricalColumn:
+    """
+    Append-only column of repeated strings (org, country_name) stored as array('I') codes
+    into the list of distinct values. Indexing and iteration return the strings.
+    """
+    
+    def __init__(self):
+        self.codes = array('I')
+        self.values = []
+        self.index = {}
+    
+    def append(self, value):
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.values)
+            self.values.append(value)
+        self.codes.append(code)
+    
+    def __len__(self):
+        return len(self.codes)
+    
+    def __getitem__(self, i):
+        return self.values[self.codes[i]]
+    
+    def __iter__(self):
+        return (self.values[code] for code in self.codes)
+
+
+def _iter_groups(keys, positions=None, min_count=1):
+    """
+    Group positions by their key (or by their row of keys when keys is 2-D) with a stable
+    numpy sort; positions default to the indexes of keys. Yields (key, positions of the
+    group in their original order) for every group with at least min_count members.
+    """
+    import numpy as np
+    
+    if keys.ndim == 1:
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        changes = sorted_keys[1:] != sorted_keys[:-1]
+    else:
+        order = np.lexsort(keys.T[::-1])
+        sorted_keys = keys[order]
+        changes = (sorted_keys[1:] != sorted_keys[:-1]).any(axis=1)
+    if positions is not None:
+        order = positions[order]
+    
+    starts = np.concatenate(([0], np.flatnonzero(changes) + 1))
+    ends = np.append(starts[1:], len(keys))
+    for start, end in zip(starts, ends):
+        if end - start >= min_count:
+            yield sorted_keys[start], order[start:end]
+
+
+def _aggregate_row(kind, group, members, ips, orgs, codes, highlight):
+    """
+    Build one aggregated report row from the positions (members) of a group in the ips
+    and orgs columns. codes is the orgs codes as a numpy array and highlight a numpy bool
+    per distinct org. org is the most common org (ties go to the first name in sort order);
+    the row is only highlighted when every IP in it belongs to one of HIGHLIGHT_ORGS.
+    """
+    import numpy as np
+    
+    member_codes = codes[members]
+    org_codes, org_counts = np.unique(member_codes, return_counts=True)
+    named = [(orgs.values[code], int(n)) for code, n in zip(org_codes, org_counts) if orgs.values[code]]
+    highlighted = int(highlight[member_codes].sum())
+    return {
+        'group': group,
+        'kind': kind,
+        'count': len(members),
+        'org': min(named, key=lambda item: (-item[1], item[0]))[0] if named else '',
+        'orgs': len(named),
+        'highlighted': f"{highlighted}/{len(members)}",
+        'sample_ips': ", ".join(ips[int(i)] for i in members[:AGGREGATE_SAMPLE_SIZE]),
+        'highlight': highlighted == len(members),
+    }
+
+
+def _column_arrays(ips, orgs):
+    """
+    Return numpy views of the IPColumn and CategoricalColumn buffers (one 17-byte row per
+    IP and the org codes, without copying) and a bool per distinct org telling whether it
+    is highlighted
+    """
+    import numpy as np
+    
+    addresses = np.frombuffer(ips.data, dtype=np.uint8).reshape(-1, IPColumn.WIDTH)
+    codes = np.frombuffer(orgs.codes, dtype=orgs.codes.typecode)
+    highlight = np.array([bool(org) and any(target in org for target in HIGHLIGHT_ORGS) for org in orgs.values],
+                         dtype=bool)
+    return addresses, codes, highlight
+
+
+def aggregate_by_network(ips, orgs, prefix_length=None, ipv6_prefix_length=None, min_count=None):
+    """
+    Group IP addresses by network prefix using vectorized integer masking.
+    ips is an IPColumn and orgs the parallel CategoricalColumn; both are read through
+    numpy views of their buffers, and address strings are only built for the sample IPs.
+    
+    Returns:
+        list: one row per network with at least min_count IPs, largest first
+    """
+    import numpy as np
+    
+    prefix_length = prefix_length or AGGREGATE_PREFIX_LENGTH
+    ipv6_prefix_length = ipv6_prefix_length or AGGREGATE_IPV6_PREFIX_LENGTH
+    min_count = AGGREGATE_MIN_COUNT if min_count is None else min_count
+    
+    addresses, codes, highlight = _column_arrays(ips, orgs)
+    is_v4 = addresses[:, 0] == 4
+    rows = []
+    
+    # === IPv4: the last 4 address bytes as big-endian uint32, masked to the prefix ===
+    v4_positions = np.flatnonzero(is_v4)
+    if len(v4_positions):
+        values = np.ascontiguousarray(addresses[v4_positions, 13:]).view('>u4').reshape(-1)
+        mask = np.uint32((0xFFFFFFFF << (32 - prefix_length)) & 0xFFFFFFFF)
+        for network, members in _iter_groups(values & mask, v4_positions, min_count):
+            group = f"{ipaddress.IPv4Address(int(network))}/{prefix_length}"
+            rows.append(_aggregate_row('network', group, members, ips, orgs, codes, highlight))
+    
+    # === IPv6: the 16 address bytes as two big-endian uint64 columns, masked to the prefix ===
+    v6_positions = np.flatnonzero(~is_v4)
+    if len(v6_positions):
+        prefix_mask = ((1 << 128) - 1) ^ ((1 << (128 - ipv6_prefix_length)) - 1)
+        mask = np.array([prefix_mask >> 64, prefix_mask & 0xFFFFFFFFFFFFFFFF], dtype=np.uint64)
+        values = np.ascontiguousarray(addresses[v6_positions, 1:]).view('>u8') & mask
+        for (high, low), members in _iter_groups(values, v6_positions, min_count):
+            group = f"{ipaddress.IPv6Address((int(high) << 64) | int(low))}/{ipv6_prefix_length}"
+            rows.append(_aggregate_row('network', group, members, ips, orgs, codes, highlight))
+    
+    rows.sort(key=lambda row: row['count'], reverse=True)
+    return rows
+
 
-    # === Save workbook ===
-    wb.save(master_xlsx_path)
-    print(f"Data appended and formatted in: {master_xlsx_path}, sheet: {sheet_name}")
+def aggregate_by_org(ips, orgs):
+    """
+    Group IP addresses by org (which includes the ASN, e.g. 'AS15169 Google LLC'), using
+    the org codes of the CategoricalColumn.
+    
+    Returns:
+        list: one row per org, largest first
+    """
+    addresses, codes, highlight = _column_arrays(ips, orgs)
+    rows = []
+    for code, members in _iter_groups(codes):
+        org = orgs.values[code] or '(unknown)'
+        row = _aggregate_row('org', org, members, ips, orgs, codes, highlight)
+        row.update(org=org, orgs=1)
+        rows.append(row)
+    
+    rows.sort(key=lambda row: row['count'], reverse=True)
+    return rows
+
+
+def write_aggregated_report(ips, orgs, master_xlsx_path, sheet_name):
+    """
+    Write the '<sheet_name>_networks' review sheet: the day's new IPs grouped by network
+    prefix and by org, with counts, sample IPs and highlight status. A network is only
+    filled red when all of its IPs are highlighted, since extract_ips_from_sheet.py can
+    add red networks to the Pass List as a whole.
+    """
+    rows = aggregate_by_network(ips, orgs) + aggregate_by_org(ips, orgs)
+    columns = ['group', 'kind', 'count', 'org', 'orgs', 'highlighted', 'sample_ips']
+    
+    with ExcelSink(master_xlsx_path, f"{sheet_name}_networks", HIGHLIGHT_ORGS) as sink:
+        sink.open(columns)
+        for row in rows:
+            sink.write(row)
+    
+    print(f"Aggregated {len(ips)} new IPs into {len(rows)} network/org rows")
+
+
+def load_report_columns(output_dir, sheet_name):
+    """
+    Rebuild the IP and org columns of the aggregated report from the checkpoint journal of
+    a sheet: every IP looked up or tagged from a known range today, once. Used by watch
+    mode, whose polls only see their own new IPs.
+    
+    Returns:
+        tuple: (IPColumn, CategoricalColumn)
+    """
+    ips = IPColumn()
+    orgs = CategoricalColumn()
+    for ip, record in load_enrichment_journal(get_journal_path(output_dir, sheet_name)).items():
+        if record['status'] in ('ok', 'tagged'):
+            ips.append(ip)
+            orgs.append(record['data'].get('org', ''))
+    return ips, orgs
+
+
+def count_rollups(rollups, records):
+    """Count records per org, country and matching HIGHLIGHT_ORGS entry into the rollup counters"""
+    for record in records:
+        org = record.get('org') or ''
+        rollups['org'][org] += 1
+        rollups['country'][record.get('country_name') or ''] += 1
+        for target_org in HIGHLIGHT_ORGS:
+            if target_org in org:
+                rollups['highlight'][target_org] += 1
+
+
+def process_ip_addresses_from_set(ip_set, output_dir, master_xlsx_path, sheet_name, known_ranges=None,
+                                  history=None, alert_stats=None, extra_columns=None, append=False,
+                                  cache=None, sinks=None, limiter=None, passlist=None, max_lookups=None):
+    """
+    Process a set of IP addresses and write them to the report sinks (by default the
+    OUTPUT_FORMATS sinks, e.g. the date sheet of the Excel workbook). Rows are written in
+    batches of OUTPUT_BATCH_SIZE as enrichment results arrive.
+    IPs inside known_ranges (an IPRangeIndex) are tagged locally and skip ipinfo.
+    IPs covered by passlist (an IPRangeIndex from load_passlist) skip ipinfo too and are
+    reported with passlisted=yes or left out, depending on PASSLIST_ACTION.
+    If history (an IPHistoryIndex) is given, enrichment results are stored in it,
+    first_seen/days_seen columns are added to the sheet and the day's new IPs are counted
+    per org, country and highlight rule in its rollup table.
+    If alert_stats (from extract_ip_snapshot) is given, IPs are enriched in hit-count order
+    and hits/signatures/last_alert columns are added to the sheet.
+    extra_columns maps additional column names to dicts of ip -> value (e.g. interfaces).
+    With append=True the rows are added to an existing sheet instead of replacing it, and
+    cache is an in-memory enrichment cache shared between calls (both used by watch mode).
+    When appending, IPs deferred by ENRICHMENT_MAX_LOOKUPS get no row yet; they are marked
+    in the journal for the caller to pass in again.
+    limiter is an optional EnrichmentLimiter that keeps the adaptive lookup concurrency
+    between calls, and max_lookups overrides ENRICHMENT_MAX_LOOKUPS for this call (watch
+    mode passes what is left of the day's budget).
+    Unless appending, an aggregated '<sheet_name>_networks' sheet is also written when
+    AGGREGATE_REPORT is set and 'excel' is an output format (watch mode rewrites it from
+    the journal after each poll instead, see load_report_columns).
+    """
+    if not ip_set:
+        print("No IP addresses to process.")
+        return False
+        
+    print(f"Processing {len(ip_set)} IP addresses")
+    
+    # === Pre-filter pass list and known provider ranges ===
+    passlisted, ip_set = split_passlisted_ips(ip_set, passlist)
+    tagged, ips_to_enrich = tag_known_range_ips(ip_set, known_ranges)
+    
+    # Journal them too: a rerun today rebuilds the sheet from the journal's IPs
+    journal_path = get_journal_path(output_dir, sheet_name)
+    append_journal_records(journal_path, [{'ip': r['ip'], 'status': 'tagged', 'data': r} for r in tagged] +
+                           [{'ip': ip, 'status': 'passlisted'} for ip in passlisted])
+    
+    if PASSLIST_ACTION == 'flag':
+        for ip in passlisted:
+            record = {field: '' for field in IPINFO_FIELDS}
+            record['ip'] = ip
+            record['passlisted'] = 'yes'
+            tagged.append(record)
+    
+    # === Fetch Data ===
+    priority = {ip: entry['hits'] for ip, entry in alert_stats.items()} if alert_stats else None
+    enriched = iter_enriched_ip_addresses(ips_to_enrich, journal_path, priority=priority,
+                                          max_lookups=ENRICHMENT_MAX_LOOKUPS if max_lookups is None else max_lookups,
+                                          cache=cache, limiter=limiter,
+                                          emit_deferred=not append)
+    
+    columns = list(IPINFO_FIELDS)
+    if history is not None:
+        columns += ['first_seen', 'days_seen']
+    if alert_stats is not None:
+        columns += ['hits', 'signatures', 'last_alert']
+    if passlist is not None and PASSLIST_ACTION == 'flag':
+        columns.append('passlisted')
+    columns += list(extra_columns or {})
+    
+    if sinks is None:
+        sinks = build_sinks(OUTPUT_FORMATS, output_dir, master_xlsx_path, sheet_name, HIGHLIGHT_ORGS,
+                            append=append)
+    for sink in sinks:
+        sink.open(columns)
+    
+    # Only the IP and org of each row are kept for the aggregated report, in compact columns
+    aggregate = AGGREGATE_REPORT and not append and 'excel' in OUTPUT_FORMATS
+    report_ips = IPColumn()
+    report_orgs = CategoricalColumn()
+    
+    # Per-day rollup counters of the new IPs
+    rollups = {'org': Counter(), 'country': Counter(), 'highlight': Counter()}
+    
+    close_errors = []
+    try:
+        for batch in iter_batches(itertools.chain(tagged, enriched), OUTPUT_BATCH_SIZE):
+            # === Update IP history index ===
+            if history is not None:
+                history.record_enrichment(batch, datetime.date.today())
+                add_history_columns(batch, history)
+            
+            if alert_stats is not None:
+                add_alert_columns(batch, alert_stats)
+            
+            for column, values in (extra_columns or {}).items():
+                for record in batch:
+                    record[column] = values.get(record['ip'], '')
+            
+            # === Write rows to every sink ===
+            for sink in sinks:
+                for record in batch:
+                    sink.write(record)
+            
+            if aggregate:
+                for record in batch:
+                    if record.get('passlisted'):
+                        continue
+                    report_ips.append(record['ip'])
+                    report_orgs.append(record.get('org', ''))
+            
+            if history is not None:
+                count_rollups(rollups, batch)
+    finally:
+        # Close every sink even if one fails (e.g. the master.xlsx lock timed out)
+        for sink in sinks:
+            try:
+                sink.close()
+            except Exception as e:
+                close_errors.append(e)
+    if close_errors:
+        raise close_errors[0]
+    
+    # === Update daily rollups ===
+    if history is not None:
+        history.record_group_counts(datetime.date.today(), rollups, accumulate=append)
+    
+    if aggregate:
+        write_aggregated_report(report_ips, report_orgs, master_xlsx_path, sheet_name)
+    
     return True
 
 
@@ -525,91 +1707,228 @@ def process_ip_addresses(ip_file_path, output_dir, master_xlsx_path, sheet_name)
     return process_ip_addresses_from_set(ip_set, output_dir, master_xlsx_path, sheet_name)
 
 
-def main():
-    """Main function to coordinate the entire workflow"""
-    start_time = time.time()
+def get_firewalls():
+    """
+    Return the firewalls to collect from: every entry of FIREWALLS, or a single
+    firewall built from BASE_URL/WEBSITE_CREDENTIALS/DOWNLOAD_DIR when it is empty
+    """
+    if not FIREWALLS:
+        return [{
+            'name': '',
+            'base_url': BASE_URL,
+            'credentials': WEBSITE_CREDENTIALS,
+            'download_dir': DOWNLOAD_DIR,
+        }]
     
-    # Generate today's date for sheet name
-    today = datetime.datetime.now().strftime('%d_%m_%Y')
-    master_xlsx_path = os.path.join(OUTPUT_DIR, "master.xlsx")
+    return [{
+        'name': fw['name'],
+        'base_url': fw['base_url'],
+        'credentials': {'username': fw['username'], 'password': fw['password']},
+        'download_dir': os.path.join(DOWNLOAD_DIR, fw['name']),
+    } for fw in FIREWALLS]
 
-    # Create output directory if it doesn't exist
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+def collect_firewall(firewall, archive_workers=None):
+    """
+    Download and parse the blocked hosts archives (latest and previous) of one firewall.
     
-    print("=" * 60)
-    print("STEP 1: DOWNLOADING SNORT BLOCKED HOSTS FILE")
-    print("=" * 60)
+    Returns:
+        dict: name, snapshot (ip -> interfaces), previous_ips (set or None), alert_stats;
+              None if no archive could be downloaded or found
+    """
+    label = firewall['name'] or firewall['base_url']
+    download_dir = firewall['download_dir']
     
     # Download the blocked hosts file
-    downloaded_file = login_and_download_blocked_hosts(WEBSITE_CREDENTIALS)
+    downloaded_file = login_and_download_blocked_hosts(
+        firewall['credentials'], base_url=firewall['base_url'], download_dir=download_dir
+    )
+    
+    # Refresh the cached pass list in the same browser session
+    if downloaded_file and PASSLIST_REFRESH:
+        refresh_passlist_cache(firewall)
     
     if not downloaded_file:
-        print("Failed to download the file. Trying to locate the most recent download.")
+        print(f"[{label}] Failed to download the file. Trying to locate the most recent download.")
         try:
             # Try to find the latest downloaded file instead
-            downloaded_file = find_latest_download(DOWNLOAD_DIR)
+            downloaded_file = find_latest_download(download_dir)
         except FileNotFoundError as e:
-            print(f"Error: {e}")
-            print("Exiting script.")
-            return
+            print(f"[{label}] Error: {e}")
+            return None
     
     # Try to find the previous download file for comparison
-    previous_file = find_previous_download(DOWNLOAD_DIR, downloaded_file)
-    
-    print("\n" + "=" * 60)
-    print("STEP 2: EXTRACTING SNORT BLOCKED HOSTS FILES")
-    print("=" * 60)
+    previous_file = find_previous_download(download_dir, downloaded_file)
     
     try:
-        # Extract the current tar.gz file
-        extracted_file = extract_tar_gz(downloaded_file, OUTPUT_DIR)
+        # Parse every interface of the current tar.gz file
+        snapshot, alert_stats = extract_ip_snapshot(downloaded_file, OUTPUT_DIR, workers=archive_workers)
         
-        # Extract the previous tar.gz file if it exists
-        extracted_previous_file = None
+        # Parse the previous tar.gz file if it exists
+        previous_ips = None
         if previous_file:
-            # Use a different output filename to avoid overwriting
-            temp_extract_dir = os.path.join(OUTPUT_DIR, "temp_previous")
-            os.makedirs(temp_extract_dir, exist_ok=True)
-            extracted_previous_file = extract_tar_gz(previous_file, temp_extract_dir)
+            previous_snapshot, _ = extract_ip_snapshot(previous_file, OUTPUT_DIR, workers=archive_workers)
+            previous_ips = set(previous_snapshot)
     except Exception as e:
-        print(f"Error during file extraction: {e}")
+        print(f"[{label}] Error during file extraction: {e}")
+        return None
+    
+    return {
+        'name': firewall['name'],
+        'snapshot': snapshot,
+        'previous_ips': previous_ips,
+        'alert_stats': alert_stats,
+    }
+
+
+def collect_firewalls(firewalls):
+    """
+    Collect all firewalls concurrently, at most FIREWALL_WORKERS at a time.
+    The archive process pool is split between the firewalls collected in parallel.
+    
+    Returns:
+        list: results of collect_firewall for the firewalls that succeeded
+    """
+    parallel = max(1, min(FIREWALL_WORKERS, len(firewalls)))
+    archive_workers = ARCHIVE_WORKERS or max(1, (os.cpu_count() or 1) // parallel)
+    
+    if parallel == 1:
+        results = [collect_firewall(fw, archive_workers) for fw in firewalls]
+    else:
+        with ThreadPoolExecutor(max_workers=parallel) as pool:
+            results = list(pool.map(lambda fw: collect_firewall(fw, archive_workers), firewalls))
+    
+    for firewall, result in zip(firewalls, results):
+        if result is None:
+            print(f"Skipping firewall {firewall['name'] or firewall['base_url']}: no data collected")
+    return [r for r in results if r is not None]
+
+
+def merge_firewall_results(results):
+    """
+    Merge per-firewall snapshots into one de-duplicated view.
+    
+    Returns:
+        tuple: (dict: ip -> interfaces (prefixed with the firewall name when there are several),
+                set: IPs new on at least one firewall,
+                dict: ip -> merged alert stats,
+                dict: ip -> comma-separated firewalls the IP is blocked on today)
+    """
+    multiple = any(result['name'] for result in results)
+    snapshot = {}
+    presence = {}
+    new_ips = set()
+    alert_stats = {}
+    
+    for result in results:
+        name = result['name']
+        for ip, interfaces in result['snapshot'].items():
+            if multiple:
+                interfaces = ",".join(f"{name}:{iface}" for iface in interfaces.split(","))
+            snapshot[ip] = f"{snapshot[ip]},{interfaces}" if ip in snapshot else interfaces
+            presence[ip] = f"{presence[ip]},{name}" if ip in presence else name
+        
+        new_ips |= compare_ip_sets(set(result['snapshot']), result['previous_ips'])
+        merge_alert_stats(alert_stats, result['alert_stats'])
+    
+    if len(results) > 1:
+        print(f"Merged {len(results)} firewalls: {len(snapshot)} unique blocked IPs, {len(new_ips)} new")
+    return snapshot, new_ips, alert_stats, presence
+
+
+def count_removed_ips(results):
+    """Return the number of IPs blocked in a previous snapshot of any firewall but on none today"""
+    previous_ips = set()
+    today_ips = set()
+    for result in results:
+        previous_ips |= result['previous_ips'] or set()
+        today_ips.update(result['snapshot'])
+    return len(previous_ips - today_ips)
+
+
+def main():
+    """Main function to coordinate the entire workflow"""
+    start_time = time.time()
+    
+    # Generate today's date for sheet name
+    today = datetime.datetime.now().strftime('%d_%m_%Y')
+    master_xlsx_path = os.path.join(OUTPUT_DIR, "master.xlsx")
+
+    # Create output directory if it doesn't exist
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    
+    firewalls = get_firewalls()
+    
+    print("=" * 60)
+    print(f"STEP 1: DOWNLOADING AND EXTRACTING SNORT BLOCKED HOSTS FILES ({len(firewalls)} FIREWALLS)")
+    print("=" * 60)
+    
+    # Download and parse every firewall's archive concurrently
+    results = collect_firewalls(firewalls)
+    close_all_sessions()
+    
+    if not results:
+        print("No blocked hosts data collected from any firewall.")
+        print("Exiting script.")
         return
     
     print("\n" + "=" * 60)
-    print("STEP 3: COMPARING IP ADDRESSES")
+    print("STEP 2: COMPARING IP ADDRESSES")
     print("=" * 60)
     
-    # Compare IP addresses and get only new ones
-    new_ips = compare_ip_files(extracted_file, extracted_previous_file)
+    # Merge all firewalls and get only IPs that are new on at least one of them
+    today_snapshot, new_ips, alert_stats, presence = merge_firewall_results(results)
+    today_ips = set(today_snapshot)
+    
+    # A rerun today rewrites the sheet, so it also covers the IPs of the earlier runs
+    new_ips |= get_journal_ips(OUTPUT_DIR, today)
+    
+    # Keep Snort alert hits of the new IPs to rank enrichment
+    alert_stats = {ip: entry for ip, entry in alert_stats.items() if ip in new_ips}
+    
+    # Record today's full blocked set in the IP history index
+    history = IPHistoryIndex(os.path.join(OUTPUT_DIR, "ip_history.db"))
+    history.record_sightings(today_ips, datetime.date.today())
     
     print("\n" + "=" * 60)
-    print("STEP 4: PROCESSING NEW IP ADDRESSES")
+    print("STEP 3: PROCESSING NEW IP ADDRESSES")
     print("=" * 60)
     
+    # Load published provider ranges and the pass lists so matching IPs skip the API
+    known_ranges = load_known_ranges(KNOWN_RANGES_DIR)
+    passlist = load_passlist(firewalls)
+    
+    # Add a per-firewall presence column when more than one firewall is collected
+    extra_columns = {'interfaces': today_snapshot}
+    if len(firewalls) > 1:
+        extra_columns['firewalls'] = presence
+    
     # Process only the new IP addresses and update Excel
-    success = process_ip_addresses_from_set(new_ips, OUTPUT_DIR, master_xlsx_path, sheet_name=today)
+    try:
+        success = process_ip_addresses_from_set(new_ips, OUTPUT_DIR, master_xlsx_path, sheet_name=today,
+                                                known_ranges=known_ranges, history=history,
+                                                alert_stats=alert_stats, extra_columns=extra_columns,
+                                                passlist=passlist)
+    except TimeoutError as e:
+        # Another job kept master.xlsx locked; the enriched rows stay in today's journal
+        print(f"Could not update the master workbook: {e}")
+        success = False
     
-    # Clean up temporary extraction directory for previous file if it exists
-    if previous_file and os.path.exists(os.path.join(OUTPUT_DIR, "temp_previous")):
-        shutil.rmtree(os.path.join(OUTPUT_DIR, "temp_previous"))
+    # Update today's rollup totals and export the trend summary from the rollups only
+    history.record_day_totals(datetime.date.today(), len(today_ips), len(new_ips), count_removed_ips(results))
+    history.write_rollup_summary(os.path.join(OUTPUT_DIR, TREND_SUMMARY_FILE))
+    history.close()
     
     print("\n" + "=" * 60)
-    print("STEP 5: CLEANING UP SNORT FILES")
+    print("STEP 4: CLEANING UP SNORT FILES")
     print("=" * 60)
     
     # Clean up old snort files, keeping only the 2 most recent ones
-    cleanup_old_snort_files(DOWNLOAD_DIR, keep_latest=2)
+    for firewall in firewalls:
+        cleanup_old_snort_files(firewall['download_dir'], keep_latest=2)
     
-    # Delete the snort.txt file
-    snort_txt_path = os.path.join(OUTPUT_DIR, "snort.txt")
-    if os.path.exists(snort_txt_path):
-        try:
-            os.remove(snort_txt_path)
-            print(f"Deleted file: {snort_txt_path}")
-        except Exception as e:
-            print(f"Error deleting file {snort_txt_path}: {e}")
-    else:
-        print(f"File not found: {snort_txt_path}")
+    # Keep only today's checkpoint journal so a rerun today can resume
+    cleanup_old_journals(OUTPUT_DIR, keep_sheet_name=today)
     
     if success:
         print("\n" + "=" * 60)
@@ -624,5 +1943,152 @@ def main():
     print(f"Total execution time: {elapsed_time:.2f} seconds")
 
 
+def poll_firewall(firewall, state):
+    """
+    Download and parse the current archive of one firewall in watch mode, reusing its
+    shared logged-in browser session, which logs in again if it expired.
+    
+    Returns:
+        dict: like collect_firewall, with previous_ips taken from the last poll in memory;
+              None if nothing could be downloaded
+    """
+    name = firewall['name']
+    label = name or firewall['base_url']
+    download_dir = firewall['download_dir']
+    
+    try:
+        session = get_session(firewall['base_url'], firewall['credentials'])
+        downloaded_file = download_blocked_hosts(session, download_dir)
+    except Exception as e:
+        print(f"[{label}] An error occurred: {e}")
+        close_session(firewall['base_url'], firewall['credentials'])
+        return None
+    
+    if not downloaded_file:
+        return None
+    
+    try:
+        previous_ips = state['snapshots'].get(name)
+        if previous_ips is None:
+            # First poll: compare with the previous download on disk, like a one-shot run
+            previous_file = find_previous_download(download_dir, downloaded_file)
+            if previous_file:
+                previous_ips = set(extract_ip_snapshot(previous_file, OUTPUT_DIR)[0])
+        
+        snapshot, alert_stats = extract_ip_snapshot(downloaded_file, OUTPUT_DIR)
+    except Exception as e:
+        # A partial or corrupt archive; the next poll downloads a new one
+        print(f"[{label}] Could not read {downloaded_file}: {e}")
+        return None
+    
+    state['snapshots'][name] = set(snapshot)
+    cleanup_old_snort_files(download_dir, keep_latest=2)
+    
+    return {
+        'name': name,
+        'snapshot': snapshot,
+        'previous_ips': previous_ips,
+        'alert_stats': alert_stats,
+    }
+
+
+def watch(interval=WATCH_INTERVAL):
+    """
+    Stay resident and poll every firewall every interval seconds. The last snapshot,
+    the enrichment cache and lookup limiter, the provider ranges and the browser sessions
+    are kept in memory, and only IPs new since the previous poll are enriched and appended
+    to the day's sheet. The '<date>_networks' sheet is rewritten with the whole day after
+    every poll that found new IPs. ENRICHMENT_MAX_LOOKUPS is a daily budget shared by the
+    polls; it restarts with the watcher.
+    """
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    master_xlsx_path = os.path.join(OUTPUT_DIR, "master.xlsx")
+    firewalls = get_firewalls()
+    known_ranges = load_known_ranges(KNOWN_RANGES_DIR)
+    history = IPHistoryIndex(os.path.join(OUTPUT_DIR, "ip_history.db"))
+    state = {'snapshots': {}, 'cache': {}, 'limiter': EnrichmentLimiter(), 'passlist': None, 'day': None,
+             'lookups_at_day_start': 0}
+    
+    print(f"Watching {len(firewalls)} firewall(s) every {interval} seconds. Press Ctrl+C to stop.")
+    
+    try:
+        while True:
+            poll_start = time.time()
+            today = datetime.datetime.now().strftime('%d_%m_%Y')
+            
+            print("\n" + "=" * 60)
+            print(f"POLL AT {datetime.datetime.now().strftime('%H:%M:%S')}")
+            print("=" * 60)
+            
+            previous_snapshots = dict(state['snapshots'])
+            try:
+                if state['day'] != today:
+                    # New day: start a new sheet and drop yesterday's journal
+                    cleanup_old_journals(OUTPUT_DIR, keep_sheet_name=today)
+                    
+                    # Re-read the pass lists once a day
+                    if PASSLIST_REFRESH:
+                        for firewall in firewalls:
+                            refresh_passlist_cache(firewall)
+                    state['passlist'] = load_passlist(firewalls)
+                    state['day'] = today
+                    state['lookups_at_day_start'] = state['limiter'].lookups()
+                
+                results = [r for r in (poll_firewall(fw, state) for fw in firewalls) if r is not None]
+                if results:
+                    snapshot, new_ips, alert_stats, presence = merge_firewall_results(results)
+                    # IPs deferred by the lookup quota on earlier polls are looked up now
+                    new_ips |= get_journal_ips(OUTPUT_DIR, today, statuses={'deferred'})
+                    history.record_sightings(set(snapshot), datetime.date.today())
+                    
+                    extra_columns = {'interfaces': snapshot}
+                    if len(firewalls) > 1:
+                        extra_columns['firewalls'] = presence
+                    
+                    # ENRICHMENT_MAX_LOOKUPS is for the whole day, not for each poll
+                    max_lookups = None
+                    if ENRICHMENT_MAX_LOOKUPS is not None:
+                        used = state['limiter'].lookups() - state['lookups_at_day_start']
+                        max_lookups = max(0, ENRICHMENT_MAX_LOOKUPS - used)
+                        print(f"Daily lookup budget: {used} of {ENRICHMENT_MAX_LOOKUPS} used")
+                    
+                    process_ip_addresses_from_set(
+                        new_ips, OUTPUT_DIR, master_xlsx_path, sheet_name=today,
+                        known_ranges=known_ranges, history=history,
+                        alert_stats={ip: entry for ip, entry in alert_stats.items() if ip in new_ips},
+                        extra_columns=extra_columns, append=True, cache=state['cache'],
+                        limiter=state['limiter'], passlist=state['passlist'], max_lookups=max_lookups
+                    )
+                    history.record_day_totals(datetime.date.today(), len(snapshot), len(new_ips),
+                                              count_removed_ips(results), accumulate=True)
+                    history.write_rollup_summary(os.path.join(OUTPUT_DIR, TREND_SUMMARY_FILE))
+                    
+                    # Appending skips the aggregated sheet; rebuild it from the day's journal
+                    if new_ips and AGGREGATE_REPORT and 'excel' in OUTPUT_FORMATS:
+                        report_ips, report_orgs = load_report_columns(OUTPUT_DIR, today)
+                        write_aggregated_report(report_ips, report_orgs, master_xlsx_path, today)
+            
+            except Exception as e:
+                # Keep watching. The previous snapshots are restored so this poll's new IPs
+                # count as new again on the next poll (their lookups are cached), e.g. after
+                # another job kept master.xlsx locked for too long
+                print(f"Poll failed: {type(e).__name__}: {e}")
+                state['snapshots'] = previous_snapshots
+            
+            elapsed = time.time() - poll_start
+            print(f"Poll completed in {elapsed:.2f} seconds")
+            time.sleep(max(0, interval - elapsed))
+    
+    except KeyboardInterrupt:
+        print("\nStopping watch mode...")
+    
+    finally:
+        close_all_sessions()
+        history.close()
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if '--watch' in sys.argv:
+        watch()
+    else:
+        main()
\ No newline at end of file
@@ -2,14 +2,8 @@ import os
 import re
 import datetime
 import time
-from openpyxl import load_workbook
-from openpyxl.styles import PatternFill
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
+from firewall_session import get_session, close_session
+from output_sinks import load_workbook_snapshot
 
 # Configuration
 OUTPUT_DIR = r""
@@ -24,103 +18,30 @@ WEBSITE_CREDENTIALS = {
     'password': ''
 }
 BASE_URL = ""
-
-
-def setup_chrome_driver():
-    """
-    Setup Chrome WebDriver with options to handle SSL and other configurations
-    """
-    # Chrome options
-    chrome_options = Options()
-    chrome_options.add_argument('--ignore-ssl-errors=yes')
-    chrome_options.add_argument('--ignore-certificate-errors')
-    chrome_options.add_argument('--disable-web-security')
-    chrome_options.add_argument('--allow-running-insecure-content')
-    
-    # Reduce logging
-    chrome_options.add_argument('--log-level=3')
-    chrome_options.add_experimental_option('excludeSwitches', ['enable-logging'])
-    
-    # Try to use WebDriverManager if installed
-    try:
-        from webdriver_manager.chrome import ChromeDriverManager
-        service = Service(ChromeDriverManager().install())
-    except ImportError:
-        # Fallback to manual path if WebDriverManager is not installed
-        service = Service(r"C:\path\to\chromedriver.exe")  # Replace with your actual path
-    
-    # Create and return the WebDriver
-    return webdriver.Chrome(service=service, options=chrome_options)
-
-
-def login_to_website(driver, credentials):
-    """
-    Login to the website using provided credentials
-    """
-    try:
-        # Navigate to the website
-        print("Navigating to login page...")
-        driver.get(BASE_URL)
-        
-        # Find and interact with username field
-        username_field = WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.ID, "usernamefld"))
-        )
-        username_field.clear()
-        username_field.send_keys(credentials['username'])
-        
-        # Find and interact with password field
-        password_field = WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.ID, "passwordfld"))
-        )
-        password_field.clear()
-        password_field.send_keys(credentials['password'])
-        
-        # Find and click login button
-        login_button = WebDriverWait(driver, 10).until(
-            EC.element_to_be_clickable((By.CSS_SELECTOR, "input[name='login'][value='Sign In']"))
-        )
-        login_button.click()
-        
-        # Wait for login to complete
-        print("Logging in...")
-        time.sleep(3)
-        
-        return True
-        
-    except Exception as e:
-        print(f"Login failed: {e}")
-        return False
+PASSLIST_PATH = "snort/snort_passlist_edit.php?id=0"
 
 
 def add_ips_to_passlist(ip_list):
     """
-    Add IP addresses to the Pass List using Selenium
+    Add IP addresses to the Pass List using Selenium, in the shared logged-in firewall session
     """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    
     if not ip_list:
         print("No IP addresses to add to Pass List.")
         return False
     
     print(f"Adding {len(ip_list)} IP addresses to Pass List...")
     
-    # Initialize the WebDriver
-    driver = setup_chrome_driver()
+    # Get the shared browser session (logs in only if there is no valid session)
+    session = get_session(BASE_URL, WEBSITE_CREDENTIALS)
     
     try:
-        # Login to the website
-        if not login_to_website(driver, WEBSITE_CREDENTIALS):
-            print("Failed to login to the website.")
-            return False
-        
-        print("Successfully logged in to the website.")
-        
         # Navigate to Pass List edit page
-        passlist_url = "https://10.35.32.1:8443/snort/snort_passlist_edit.php?id=0"
-        print(f"Navigating to Pass List page: {passlist_url}")
-        driver.get(passlist_url)
-        
-        # Wait for page to load
-        time.sleep(2)
+        print(f"Navigating to Pass List page: {BASE_URL + PASSLIST_PATH}")
+        driver = session.open(PASSLIST_PATH)
         
         # Add each IP address
         for i, ip in enumerate(ip_list, 1):
@@ -193,13 +114,9 @@ def add_ips_to_passlist(ip_list):
         
     except Exception as e:
         print(f"Error adding IPs to Pass List: {e}")
+        session.forget_cookies()
+        close_session(BASE_URL, WEBSITE_CREDENTIALS)
         return False
-    
-    finally:
-        # Close the browser
-        print("Closing browser...")
-        if 'driver' in locals():
-            driver.quit()
 
 
 def extract_red_ips_from_newest_sheet(org_choice=None):
@@ -208,7 +125,8 @@ def extract_red_ips_from_newest_sheet(org_choice=None):
     in the Excel workbook and save them to a text file.
     
     Args:
-        org_choice: Integer 1-5 for specific organization, 5 for all, None for prompt
+        org_choice: Integer 1-4 for specific organization, 5 for all, 6 for red networks
+                    from the aggregated '<date>_networks' sheet, None for prompt
     
     Returns:
         tuple: (bool: success, list: extracted IPs, str: organization name, str: output file path)
@@ -225,14 +143,15 @@ def extract_red_ips_from_newest_sheet(org_choice=None):
         print("3 - Amazon.com")
         print("4 - Akamai")
         print("5 - All red-highlighted IPs")
+        print("6 - All red-highlighted networks (one Pass List entry per aggregated network)")
         
         try:
-            org_choice = int(input("\nEnter your choice (1-5): "))
-            if org_choice < 1 or org_choice > 5:
-                print("Invalid choice. Please enter a number between 1 and 5.")
+            org_choice = int(input("\nEnter your choice (1-6): "))
+            if org_choice < 1 or org_choice > 6:
+                print("Invalid choice. Please enter a number between 1 and 6.")
                 return False, [], "", ""
         except ValueError:
-            print("Invalid input. Please enter a number between 1 and 5.")
+            print("Invalid input. Please enter a number between 1 and 6.")
             return False, [], "", ""
     
     # Map choice to organization name
@@ -259,6 +178,14 @@ def extract_red_ips_from_newest_sheet(org_choice=None):
         selected_org = None  # All organizations
         org_name_for_file = "all"
         org_display_name = "All red IPs"
+    elif org_choice == 6:
+        selected_org = None  # All organizations, whole networks
+        org_name_for_file = "networks"
+        org_display_name = "All red networks"
+    
+    # Networks come from the aggregated sheet, where the 'group' column holds the CIDR
+    networks_mode = org_choice == 6
+    ip_column = 'group' if networks_mode else 'ip'
     
     print(f"Selected organization: {org_display_name}")
     
@@ -267,9 +194,9 @@ def extract_red_ips_from_newest_sheet(org_choice=None):
         print(f"Error: Master Excel file not found at {MASTER_XLSX_PATH}")
         return False, [], org_display_name, ""
     
-    # Load the workbook
+    # Load a consistent snapshot of the workbook; check_ip.py may be writing it right now
     print(f"Loading workbook: {MASTER_XLSX_PATH}")
-    wb = load_workbook(MASTER_XLSX_PATH)
+    wb = load_workbook_snapshot(MASTER_XLSX_PATH)
     
     # Get sheet names
     sheet_names = wb.sheetnames
@@ -277,14 +204,16 @@ def extract_red_ips_from_newest_sheet(org_choice=None):
         print("Error: No sheets found in the workbook")
         return False, [], org_display_name, ""
     
-    # Find sheets with date pattern (dd_mm_yyyy)
+    # Find sheets with date pattern (dd_mm_yyyy), plus the dd_mm_yyyy_N continuation
+    # sheets written when a day exceeds the Excel row limit
     date_sheets = []
     for sheet_name in sheet_names:
-        if re.match(r'^\d{2}_\d{2}_\d{4}$', sheet_name):
+        date_match = re.match(r'^(\d{2}_\d{2}_\d{4})(?:_\d+)?$', sheet_name)
+        if date_match:
             # Convert sheet name to datetime for comparison
             try:
-                sheet_date = datetime.datetime.strptime(sheet_name, '%d_%m_%Y')
-                date_sheets.append((sheet_name, sheet_date))
+                sheet_date = datetime.datetime.strptime(date_match.group(1), '%d_%m_%Y')
+                date_sheets.append((date_match.group(1), sheet_date, sheet_name))
             except ValueError:
                 # Skip sheets that don't match our expected date format
                 continue
@@ -297,49 +226,77 @@ def extract_red_ips_from_newest_sheet(org_choice=None):
     date_sheets.sort(key=lambda x: x[1], reverse=True)
     newest_sheet_name = date_sheets[0][0]
     
-    print(f"Found newest sheet: {newest_sheet_name} (Date: {date_sheets[0][1].strftime('%d-%m-%Y')})")
-    
-    # Get the newest sheet
-    ws = wb[newest_sheet_name]
-    
-    # Find column indices for IP and organization
-    ip_col_index = None
-    org_col_index = None
-    
-    for idx, cell in enumerate(ws[1], start=1):
-        if cell.value == 'ip':
-            ip_col_index = idx
-        elif cell.value == 'org':
-            org_col_index = idx
-    
-    if not ip_col_index:
-        print("Error: Could not find 'ip' column in the sheet")
-        return False, [], org_display_name, ""
+    newest_sheets = [name for date_name, _, name in date_sheets if date_name == newest_sheet_name]
+    if networks_mode:
+        newest_sheets = [f"{newest_sheet_name}_networks"]
+        if newest_sheets[0] not in sheet_names:
+            print(f"Error: Aggregated sheet {newest_sheets[0]} not found. check_ip.py only writes it "
+                  f"when AGGREGATE_REPORT is on and 'excel' is in OUTPUT_FORMATS; in watch mode it "
+                  f"appears after the first poll with new IPs.")
+            return False, [], org_display_name, ""
     
-    if not org_col_index and selected_org:
-        print("Warning: Could not find 'org' column in the sheet, but organization filtering was requested")
-        print("Will fall back to checking all red rows")
-        selected_org = None
+    print(f"Found newest sheet: {newest_sheet_name} (Date: {date_sheets[0][1].strftime('%d-%m-%Y')})")
+    if len(newest_sheets) > 1:
+        print(f"Sheet continues on {len(newest_sheets) - 1} more sheet(s)")
     
-    # Extract red-highlighted IP addresses
     red_ips = []
-    for row in ws.iter_rows(min_row=2, max_row=ws.max_row):  # Skip header row
-        # Check if any cell in the row has red fill
-        is_red = any(cell.fill.start_color.rgb == RED_FILL_COLOR for cell in row)
+    for sheet_name in newest_sheets:
+        # Get the newest sheet
+        ws = wb[sheet_name]
+        
+        # Find column indices for IP and organization
+        ip_col_index = None
+        org_col_index = None
+        kind_col_index = None
+        highlighted_col_index = None
+        
+        for idx, cell in enumerate(ws[1], start=1):
+            if cell.value == ip_column:
+                ip_col_index = idx
+            elif cell.value == 'org':
+                org_col_index = idx
+            elif cell.value == 'kind':
+                kind_col_index = idx
+            elif cell.value == 'highlighted':
+                highlighted_col_index = idx
+        
+        if not ip_col_index:
+            print(f"Error: Could not find '{ip_column}' column in the sheet {sheet_name}")
+            return False, [], org_display_name, ""
+        
+        if not org_col_index and selected_org:
+            print("Warning: Could not find 'org' column in the sheet, but organization filtering was requested")
+            print("Will fall back to checking all red rows")
+            selected_org = None
         
-        if is_red:
-            ip_cell = row[ip_col_index - 1]  # Adjusting for 0-based indexing
+        # Extract red-highlighted IP addresses
+        for row in ws.iter_rows(min_row=2, max_row=ws.max_row):  # Skip header row
+            # Check if any cell in the row has red fill
+            is_red = any(cell.fill.start_color.rgb == RED_FILL_COLOR for cell in row)
             
-            # If we're filtering by organization, check the org field
-            if selected_org and org_col_index:
-                org_cell = row[org_col_index - 1]
-                if org_cell.value and selected_org in org_cell.value:
+            # The aggregated sheet also has per-org rows; only networks go to the Pass List
+            if networks_mode and kind_col_index and row[kind_col_index - 1].value != 'network':
+                continue
+            
+            # A whole network is only passed when every IP in it is highlighted ('n/n')
+            if networks_mode and highlighted_col_index:
+                highlighted, _, total = str(row[highlighted_col_index - 1].value or '').partition('/')
+                if highlighted != total:
+                    continue
+            
+            if is_red:
+                ip_cell = row[ip_col_index - 1]  # Adjusting for 0-based indexing
+                
+                # If we're filtering by organization, check the org field
+                if selected_org and org_col_index:
+                    org_cell = row[org_col_index - 1]
+                    if org_cell.value and selected_org in org_cell.value:
+                        if ip_cell.value:
+                            red_ips.append(ip_cell.value)
+                # Otherwise include all red IPs
+                elif not selected_org:
                     if ip_cell.value:
                         red_ips.append(ip_cell.value)
-            # Otherwise include all red IPs
-            elif not selected_org:
-                if ip_cell.value:
-                    red_ips.append(ip_cell.value)
     
     print(f"Found {len(red_ips)} IP addresses matching your criteria")
     
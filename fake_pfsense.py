@@ -0,0 +1,329 @@
+import io
+import sys
+import json
+import zlib
+import time
+import random
+import secrets
+import tarfile
+import argparse
+import datetime
+import ipaddress
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from html import escape
+
+# ========== STAND-IN CONFIGURATION ==========
+# A local stand-in for the pfSense web interface (login, Snort blocked hosts download,
+# Pass List edit page) and for the ipinfo API, used by load_test.py
+USERNAME = "admin"
+PASSWORD = "pfsense"
+SESSION_TTL = 600  # seconds before a login expires
+INTERFACES = ['em0', 'igb1']
+BLOCKED_COUNT = 1000  # IPs in the block table
+CHURN = 0.05  # fraction of the block table replaced between two downloads
+PASSLIST_COUNT = 0  # initial pass list entries, alternately /24 networks and single IPs of blocked hosts
+PASSLIST_LEAK = 0.1  # fraction of churned-in IPs taken from the pass list (stale block entries)
+
+# ========== IPINFO STAND-IN CONFIGURATION ==========
+IPINFO_LATENCY = 0.05  # seconds added to every lookup
+IPINFO_QUOTA = None  # lookups answered before every request gets 429 (None for unlimited)
+IPINFO_ERROR_RATE = 0.0  # fraction of lookups answered with 429
+IPINFO_RETRY_AFTER = 1  # seconds sent in the Retry-After header of 429 responses
+IPINFO_ORGS = [
+    ("AS15169 Google LLC", "US"),
+    ("AS8075 Microsoft Corporation", "US"),
+    ("AS16509 Amazon.com, Inc.", "US"),
+    ("AS20940 Akamai International B.V.", "NL"),
+    ("AS4134 CHINANET-BACKBONE", "CN"),
+    ("AS4837 CHINA UNICOM China169 Backbone", "CN"),
+    ("AS14061 DigitalOcean, LLC", "US"),
+    ("AS16276 OVH SAS", "FR"),
+    ("AS24940 Hetzner Online GmbH", "DE"),
+    ("AS9009 M247 Europe SRL", "RO"),
+]
+
+LOGIN_PAGE = """<html><body>
+<form method="post" action="{action}">
+<input type="text" id="usernamefld" name="usernamefld" placeholder="Username">
+<input type="password" id="passwordfld" name="passwordfld" placeholder="Password">
+<input type="submit" name="login" class="btn btn-success" value="Sign In">
+</form></body></html>"""
+
+BLOCKED_PAGE = """<html><body>
+<h1>Snort: Blocked Hosts</h1>
+<form method="post">
+<button type="submit" id="download" name="download" value="1" class="btn btn-success"
+ title="Download interface log files as a gzip archive">Download</button>
+</form>
+<p>{count} hosts blocked</p></body></html>"""
+
+PASSLIST_PAGE = """<html><body>
+<h1>Snort: Pass List Edit</h1>
+<form method="post" id="iform">
+<div id="rows">{rows}</div>
+<button type="button" id="addrow">Add IP</button>
+<button type="submit" id="save" name="save" value="Save">Save</button>
+</form>
+<script>
+var next = {count};
+document.getElementById('addrow').onclick = function() {{
+  var field = document.createElement('input');
+  field.name = 'address' + next;
+  field.id = 'address' + next;
+  field.placeholder = 'Address';
+  next++;
+  document.getElementById('rows').appendChild(field);
+}};
+</script></body></html>"""
+
+PASSLIST_ROW = '<input name="address{i}" id="address{i}" placeholder="Address" value="{value}">'
+
+
+def random_public_ip(rng):
+    """Return a random globally routable IPv4 address"""
+    while True:
+        ip = ipaddress.IPv4Address(rng.getrandbits(32))
+        if ip.is_global and not ip.is_multicast:
+            return str(ip)
+
+
+class FakePfSense(ThreadingHTTPServer):
+    """
+    HTTP server holding the stand-in state: login sessions, the block table (which churns
+    on every download), the pass list and the ipinfo request counters
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), blocked_count=BLOCKED_COUNT, churn=CHURN,
+                 ipinfo_latency=IPINFO_LATENCY, ipinfo_quota=IPINFO_QUOTA,
+                 ipinfo_error_rate=IPINFO_ERROR_RATE, session_ttl=SESSION_TTL, passlist_count=PASSLIST_COUNT,
+                 seed=1):
+        super().__init__(address, StandInRequestHandler)
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.session_ttl = session_ttl
+        self.churn = churn
+        self.blocked = [random_public_ip(self.rng) for _ in range(blocked_count)]
+        self.passlist = [
+            str(ipaddress.ip_network(f"{ip}/24", strict=False)) if i % 2 == 0 else ip
+            for i, ip in enumerate(self.rng.sample(self.blocked, min(passlist_count, blocked_count)))
+        ]
+        self.ipinfo_latency = ipinfo_latency
+        self.ipinfo_quota = ipinfo_quota
+        self.ipinfo_error_rate = ipinfo_error_rate
+        self.stats = {'logins': 0, 'page_views': 0, 'downloads': 0, 'passlist_saves': 0,
+                      'ipinfo_requests': 0, 'ipinfo_429': 0}
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    @property
+    def ipinfo_url(self):
+        return self.url + "ipinfo"
+
+    def start(self):
+        """Serve in a background thread and return self"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+            return self.stats[key]
+
+    # === Sessions ===
+    def new_session(self):
+        token = secrets.token_hex(16)
+        with self.lock:
+            self.sessions[token] = time.time() + self.session_ttl
+        self.count('logins')
+        return token
+
+    def is_logged_in(self, token):
+        with self.lock:
+            return token is not None and self.sessions.get(token, 0) > time.time()
+
+    def expire_sessions(self):
+        """Drop every login, as if the sessions timed out"""
+        with self.lock:
+            self.sessions.clear()
+
+    # === Snort blocked hosts ===
+    def build_archive(self):
+        """
+        Churn the block table and return (file name, tar.gz bytes) with one block file and
+        one CSV alert log per interface
+        """
+        with self.lock:
+            if self.stats['downloads']:
+                for _ in range(int(len(self.blocked) * self.churn)):
+                    self.blocked[self.rng.randrange(len(self.blocked))] = self._churned_ip()
+            number = self.stats['downloads'] = self.stats['downloads'] + 1
+            blocked = list(self.blocked)
+
+        now = datetime.datetime.now()
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+            for index, interface in enumerate(INTERFACES):
+                ips = blocked[index::len(INTERFACES)]
+                alerts = [
+                    f'{now.strftime("%m/%d/%y-%H:%M:%S")}.000000 ,1,{2000000 + i % 50},1,'
+                    f'"ET SCAN stand-in {i % 50}",TCP,{ip},{1024 + i % 60000},192.168.1.10,443,0,Attempted Recon,2'
+                    for i, ip in enumerate(ips) for _ in range(1 + i % 3)
+                ]
+                for name, lines in ((f"snort_{interface}/snort_block.pf", ips),
+                                    (f"snort_{interface}/alert", alerts)):
+                    data = ("\n".join(lines) + "\n").encode()
+                    info = tarfile.TarInfo(name)
+                    info.size = len(data)
+                    info.mtime = now.timestamp()
+                    tar.addfile(info, io.BytesIO(data))
+
+        file_name = f"snort_blocked_{now.strftime('%Y%m%d_%H%M%S')}_{number}.tar.gz"
+        return file_name, buffer.getvalue()
+
+    def _churned_ip(self):
+        """A new blocked IP: usually random, sometimes one covered by the pass list"""
+        if self.passlist and self.rng.random() < PASSLIST_LEAK:
+            network = ipaddress.ip_network(self.rng.choice(self.passlist), strict=False)
+            return str(network[self.rng.randrange(network.num_addresses)])
+        return random_public_ip(self.rng)
+
+    # === ipinfo ===
+    def ipinfo_response(self, ip):
+        """Return (status, headers, body dict) for a lookup, applying quota and error rate"""
+        number = self.count('ipinfo_requests')
+        time.sleep(self.ipinfo_latency)
+
+        with self.lock:
+            throttled = self.rng.random() < self.ipinfo_error_rate
+        if (self.ipinfo_quota is not None and number > self.ipinfo_quota) or throttled:
+            self.count('ipinfo_429')
+            return 429, {'Retry-After': str(IPINFO_RETRY_AFTER)}, {'error': 'Rate limit exceeded'}
+
+        org, country = IPINFO_ORGS[zlib.crc32(ip.encode()) % len(IPINFO_ORGS)]
+        return 200, {}, {
+            'ip': ip,
+            'hostname': f"host-{ip.replace('.', '-')}.example.net",
+            'org': org,
+            'country': country,
+        }
+
+
+class StandInRequestHandler(BaseHTTPRequestHandler):
+    """Routes the pfSense pages and /ipinfo/<ip> of the stand-in server"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def _session_token(self):
+        for part in self.headers.get('Cookie', '').split(';'):
+            name, _, value = part.strip().partition('=')
+            if name == 'PHPSESSID':
+                return value
+        return None
+
+    def _send(self, status, body, content_type='text/html', headers=None):
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _form(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return {k: v[-1] for k, v in parse_qs(self.rfile.read(length).decode(), keep_blank_values=True).items()}
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+
+        if path.startswith('/ipinfo/'):
+            status, headers, body = self.server.ipinfo_response(path[len('/ipinfo/'):])
+            self._send(status, json.dumps(body), 'application/json', headers)
+            return
+
+        self.server.count('page_views')
+        if not self.server.is_logged_in(self._session_token()):
+            self._send(200, LOGIN_PAGE.format(action=escape(self.path)))
+        elif path == '/snort/snort_blocked.php':
+            self._send(200, BLOCKED_PAGE.format(count=len(self.server.blocked)))
+        elif path == '/snort/snort_passlist_edit.php':
+            self._send(200, self._passlist_page())
+        else:
+            self._send(200, "<html><body><h1>Dashboard</h1></body></html>")
+
+    def do_POST(self):
+        form = self._form()
+
+        # === Login from any page ===
+        if 'usernamefld' in form:
+            if form.get('usernamefld') == USERNAME and form.get('passwordfld') == PASSWORD:
+                token = self.server.new_session()
+                self._send(302, "", headers={'Location': self.path,
+                                             'Set-Cookie': f"PHPSESSID={token}; Path=/; HttpOnly"})
+            else:
+                self._send(200, LOGIN_PAGE.format(action=escape(self.path)))
+            return
+
+        if not self.server.is_logged_in(self._session_token()):
+            self._send(200, LOGIN_PAGE.format(action=escape(self.path)))
+            return
+
+        path = urlparse(self.path).path
+        if path == '/snort/snort_blocked.php' and 'download' in form:
+            file_name, data = self.server.build_archive()
+            self._send(200, data, 'application/octet-stream',
+                       {'Content-Disposition': f'attachment; filename="{file_name}"'})
+        elif path == '/snort/snort_passlist_edit.php' and 'save' in form:
+            fields = sorted((int(key[len('address'):]), value) for key, value in form.items()
+                            if key.startswith('address') and key[len('address'):].isdigit())
+            addresses = [value.strip() for _, value in fields]
+            with self.server.lock:
+                self.server.passlist = [address for address in addresses if address]
+            self.server.count('passlist_saves')
+            self._send(200, self._passlist_page())
+        else:
+            self._send(400, "Unsupported request")
+
+    def _passlist_page(self):
+        rows = "".join(PASSLIST_ROW.format(i=i, value=escape(value))
+                       for i, value in enumerate(self.server.passlist))
+        return PASSLIST_PAGE.format(rows=rows, count=len(self.server.passlist))
+
+
+def main(argv=None):
+    """Run the stand-in server in the foreground"""
+    parser = argparse.ArgumentParser(description="Local pfSense and ipinfo stand-in server")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--blocked', type=int, default=BLOCKED_COUNT, help="IPs in the block table")
+    parser.add_argument('--churn', type=float, default=CHURN, help="Fraction replaced per download")
+    parser.add_argument('--passlist', type=int, default=PASSLIST_COUNT, help="Initial pass list entries")
+    parser.add_argument('--ipinfo-latency', type=float, default=IPINFO_LATENCY)
+    parser.add_argument('--ipinfo-quota', type=int, default=IPINFO_QUOTA)
+    parser.add_argument('--ipinfo-error-rate', type=float, default=IPINFO_ERROR_RATE)
+    args = parser.parse_args(argv)
+
+    server = FakePfSense(('127.0.0.1', args.port), blocked_count=args.blocked, churn=args.churn,
+                         ipinfo_latency=args.ipinfo_latency, ipinfo_quota=args.ipinfo_quota,
+                         ipinfo_error_rate=args.ipinfo_error_rate, passlist_count=args.passlist)
+    print(f"pfSense stand-in at {server.url} (user {USERNAME}, password {PASSWORD}), "
+          f"ipinfo stand-in at {server.ipinfo_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping stand-in server...")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
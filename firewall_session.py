@@ -0,0 +1,280 @@
+import os
+import json
+import time
+import atexit
+import threading
+from urllib.parse import urlparse
+
+# ========== CONFIGURATION ==========
+# Logged-in cookies and the resolved chromedriver path are cached in SESSION_DIR so that
+# the next run (or the other script) can skip the login and the driver version check
+SESSION_DIR = r""
+DRIVER_CACHE_FILE = "chromedriver_path.json"
+CHROMEDRIVER_PATH = r""  # Leave empty to resolve it with webdriver-manager / Selenium Manager
+
+# ========== BROWSER CONFIGURATION ==========
+HEADLESS = True  # Set to False to watch the browser while debugging
+BLOCK_IMAGES_AND_CSS = True  # The pfSense pages work without them and load much faster
+BLOCKED_URL_PATTERNS = ["*.css", "*.png", "*.jpg", "*.gif", "*.svg", "*.ico", "*.woff", "*.woff2", "*.ttf"]
+
+_driver_path = None
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def resolve_driver_path():
+    """
+    Return the chromedriver path, resolving it at most once: from CHROMEDRIVER_PATH, from
+    the path cached in SESSION_DIR by an earlier run, or with webdriver-manager (a network
+    check). Returns None to let Selenium Manager find the driver when none of these work.
+    """
+    global _driver_path
+    if _driver_path and os.path.exists(_driver_path):
+        return _driver_path
+
+    if CHROMEDRIVER_PATH:
+        _driver_path = CHROMEDRIVER_PATH
+        return _driver_path
+
+    cache_file = os.path.join(SESSION_DIR, DRIVER_CACHE_FILE)
+    try:
+        with open(cache_file) as f:
+            cached_path = json.load(f)['path']
+        if os.path.exists(cached_path):
+            _driver_path = cached_path
+            return _driver_path
+    except (OSError, ValueError, KeyError):
+        pass
+
+    # Try to use WebDriverManager if installed
+    try:
+        from webdriver_manager.chrome import ChromeDriverManager
+        _driver_path = ChromeDriverManager().install()
+    except ImportError:
+        return None
+
+    try:
+        with open(cache_file, 'w') as f:
+            json.dump({'path': _driver_path}, f)
+    except OSError as e:
+        print(f"Could not cache chromedriver path: {e}")
+    return _driver_path
+
+
+def setup_chrome_driver(download_dir=None, headless=None):
+    """
+    Setup Chrome WebDriver with options to handle SSL, headless mode, blocked
+    images/CSS and (optionally) a download directory
+    """
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+    from selenium.webdriver.chrome.options import Options
+
+    headless = HEADLESS if headless is None else headless
+
+    # Chrome options
+    chrome_options = Options()
+    chrome_options.add_argument('--ignore-ssl-errors=yes')
+    chrome_options.add_argument('--ignore-certificate-errors')
+    chrome_options.add_argument('--allow-running-insecure-content')
+    if headless:
+        chrome_options.add_argument('--headless=new')
+        chrome_options.add_argument('--window-size=1280,1024')
+        chrome_options.add_argument('--disable-gpu')
+
+    prefs = {"safebrowsing.enabled": False}
+    if download_dir:
+        # Create download directory if it doesn't exist
+        os.makedirs(download_dir, exist_ok=True)
+        prefs.update({
+            "download.default_directory": download_dir,
+            "download.prompt_for_download": False,
+            "download.directory_upgrade": True,
+        })
+    if BLOCK_IMAGES_AND_CSS:
+        prefs["profile.managed_default_content_settings.images"] = 2
+    chrome_options.add_experimental_option("prefs", prefs)
+
+    # Reduce logging
+    chrome_options.add_argument('--log-level=3')
+    chrome_options.add_experimental_option('excludeSwitches', ['enable-logging'])
+
+    driver_path = resolve_driver_path()
+    service = Service(driver_path) if driver_path else Service()
+    driver = webdriver.Chrome(service=service, options=chrome_options)
+
+    if BLOCK_IMAGES_AND_CSS:
+        try:
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS})
+        except Exception as e:
+            print(f"Could not block stylesheets: {e}")
+
+    return driver
+
+
+def is_login_page(driver):
+    """Return True if the pfSense login form is shown (not logged in or the session expired)"""
+    from selenium.webdriver.common.by import By
+
+    return bool(driver.find_elements(By.ID, "usernamefld"))
+
+
+def login_to_firewall(driver, credentials, base_url):
+    """
+    Login to the pfSense web interface with an open WebDriver
+    """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
+    # Navigate to the website
+    print("Navigating to login page...")
+    driver.get(base_url)
+
+    # Find and interact with username field
+    username_field = WebDriverWait(driver, 10).until(
+        EC.presence_of_element_located((By.ID, "usernamefld"))
+    )
+    username_field.clear()
+    username_field.send_keys(credentials['username'])
+
+    # Find and interact with password field
+    password_field = WebDriverWait(driver, 10).until(
+        EC.presence_of_element_located((By.ID, "passwordfld"))
+    )
+    password_field.clear()
+    password_field.send_keys(credentials['password'])
+
+    # Find and click login button
+    login_button = WebDriverWait(driver, 10).until(
+        EC.element_to_be_clickable((By.CSS_SELECTOR, "input[name='login'], button[name='login'], .btn-success"))
+    )
+    login_button.click()
+
+    # Wait for login to complete
+    print("Logging in...")
+    WebDriverWait(driver, 10).until(lambda d: not is_login_page(d))
+
+
+class FirewallSession:
+    """
+    One headless browser logged in to one pfSense firewall, shared by the download,
+    pass list read and pass list write steps. The browser is started on first use, the
+    login cookies are restored from SESSION_DIR when possible, and open() logs in again
+    only when the firewall shows the login page (no session yet or the session expired).
+    """
+
+    def __init__(self, base_url, credentials):
+        self.base_url = base_url
+        self.credentials = credentials
+        self.driver = None
+        self.download_dir = None
+        host = urlparse(base_url).netloc.replace(':', '_') or 'default'
+        self.cookie_file = os.path.join(SESSION_DIR, f"session_{host}.json")
+
+    def start(self):
+        """Start the browser and restore saved cookies"""
+        if self.driver is not None:
+            return self.driver
+
+        start = time.time()
+        self.driver = setup_chrome_driver()
+        print(f"Started browser for {self.base_url} in {time.time() - start:.2f} seconds")
+
+        # Cookies can only be set for the domain of the page that is open
+        cookies = self._load_cookies()
+        if cookies:
+            self.driver.get(self.base_url)
+            for cookie in cookies:
+                try:
+                    self.driver.add_cookie(cookie)
+                except Exception:
+                    continue
+        return self.driver
+
+    def login(self):
+        """Log in from scratch and save the session cookies for later runs"""
+        login_to_firewall(self.start(), self.credentials, self.base_url)
+        self._save_cookies()
+
+    def open(self, path=""):
+        """
+        Navigate to base_url + path in the logged-in session, logging in again first if the
+        firewall answers with the login page. Returns the WebDriver.
+        """
+        driver = self.start()
+        driver.get(self.base_url + path)
+        if is_login_page(driver):
+            print("Session not logged in or expired, logging in...")
+            self.login()
+            driver.get(self.base_url + path)
+        return driver
+
+    def set_download_dir(self, download_dir):
+        """Send the following downloads to download_dir (also works in headless mode)"""
+        os.makedirs(download_dir, exist_ok=True)
+        driver = self.start()
+        if download_dir != self.download_dir:
+            driver.execute_cdp_cmd("Page.setDownloadBehavior", {"behavior": "allow", "downloadPath": download_dir})
+            self.download_dir = download_dir
+
+    def close(self):
+        if self.driver is not None:
+            print(f"Closing browser for {self.base_url}...")
+            try:
+                self.driver.quit()
+            except Exception:
+                pass
+            self.driver = None
+            self.download_dir = None
+
+    def _load_cookies(self):
+        try:
+            with open(self.cookie_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def _save_cookies(self):
+        try:
+            with open(self.cookie_file, 'w') as f:
+                json.dump(self.driver.get_cookies(), f)
+            os.chmod(self.cookie_file, 0o600)
+        except OSError as e:
+            print(f"Could not save session cookies: {e}")
+
+    def forget_cookies(self):
+        """Delete the saved cookies (e.g. after a failed step) so the next run logs in again"""
+        if os.path.exists(self.cookie_file):
+            os.remove(self.cookie_file)
+
+
+def get_session(base_url, credentials):
+    """Return the shared FirewallSession for base_url and user, creating it on first use"""
+    key = (base_url, credentials['username'])
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _sessions[key] = FirewallSession(base_url, credentials)
+        return session
+
+
+def close_session(base_url, credentials):
+    """Close and drop the shared session for base_url and user, if any"""
+    with _sessions_lock:
+        session = _sessions.pop((base_url, credentials['username']), None)
+    if session is not None:
+        session.close()
+
+
+def close_all_sessions():
+    """Close every shared browser session (also run automatically at exit)"""
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
+
+
+atexit.register(close_all_sessions)
@@ -0,0 +1,248 @@
+import os
+import sys
+import csv
+import sqlite3
+import datetime
+
+# ========== CONFIGURATION ==========
+OUTPUT_DIR = r""
+HISTORY_DB_PATH = os.path.join(OUTPUT_DIR, "ip_history.db")
+
+
+class IPHistoryIndex:
+    """
+    Persistent inverted index from IP address to the days it appeared in the blocked set
+    and to its latest enrichment record. Backed by SQLite so single-IP lookups are an
+    indexed primary key read instead of a scan of every sheet in master.xlsx.
+    """
+
+    def __init__(self, db_path=HISTORY_DB_PATH):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sightings (
+                ip TEXT NOT NULL,
+                day TEXT NOT NULL,
+                PRIMARY KEY (ip, day)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS summary (
+                ip TEXT PRIMARY KEY,
+                first_seen TEXT NOT NULL,
+                last_seen TEXT NOT NULL,
+                days_seen INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS enrichment (
+                ip TEXT PRIMARY KEY,
+                org TEXT,
+                country_name TEXT,
+                hostname TEXT,
+                updated TEXT NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS rollups (
+                day TEXT NOT NULL,
+                dimension TEXT NOT NULL,
+                key TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (day, dimension, key)
+            ) WITHOUT ROWID;
+        """)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record_sightings(self, ip_set, day):
+        """
+        Record that every IP in ip_set was blocked on day (datetime.date).
+        Rerunning for the same day is a no-op for IPs already recorded.
+        """
+        day = day.isoformat()
+        with self.conn:
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS new_sightings (ip TEXT PRIMARY KEY)")
+            self.conn.execute("DELETE FROM new_sightings")
+
+            # Keep only IPs that have no sighting for this day yet
+            for ip in ip_set:
+                cur = self.conn.execute(
+                    "INSERT OR IGNORE INTO sightings (ip, day) VALUES (?, ?)", (ip, day)
+                )
+                if cur.rowcount:
+                    self.conn.execute("INSERT INTO new_sightings (ip) VALUES (?)", (ip,))
+
+            self.conn.execute("""
+                INSERT INTO summary (ip, first_seen, last_seen, days_seen)
+                SELECT ip, ?, ?, 1 FROM new_sightings WHERE true
+                ON CONFLICT(ip) DO UPDATE SET
+                    first_seen = MIN(first_seen, excluded.first_seen),
+                    last_seen = MAX(last_seen, excluded.last_seen),
+                    days_seen = days_seen + 1
+            """, (day, day))
+            added = self.conn.execute("SELECT COUNT(*) FROM new_sightings").fetchone()[0]
+
+        print(f"Recorded {added} new sightings for {day} in {self.db_path}")
+        return added
+
+    def record_enrichment(self, records, day):
+        """
+        Store the latest enrichment record (dict with ip/org/country_name/hostname) per IP.
+        Empty fields keep the stored value, so a record tagged from a known range (org only)
+        does not blank out an earlier full ipinfo lookup.
+        """
+        day = day.isoformat()
+        with self.conn:
+            self.conn.executemany("""
+                INSERT INTO enrichment (ip, org, country_name, hostname, updated)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(ip) DO UPDATE SET
+                    org = COALESCE(NULLIF(excluded.org, ''), org),
+                    country_name = COALESCE(NULLIF(excluded.country_name, ''), country_name),
+                    hostname = COALESCE(NULLIF(excluded.hostname, ''), hostname),
+                    updated = excluded.updated
+            """, [
+                (r['ip'], r.get('org', ''), r.get('country_name', ''), r.get('hostname', ''), day)
+                for r in records if r.get('org') or r.get('country_name') or r.get('hostname')
+            ])
+
+    def record_day_totals(self, day, total, new, removed, accumulate=False):
+        """
+        Store the blocked/new/removed totals of day in the rollup table. With accumulate=True
+        (watch mode deltas) new and removed are added to the stored values; total is always
+        the latest snapshot size.
+        """
+        self._update_rollups(day, 'blocked', {'total': total}, accumulate=False)
+        self._update_rollups(day, 'blocked', {'new': new, 'removed': removed}, accumulate=accumulate)
+
+    def record_group_counts(self, day, groups, accumulate=False):
+        """
+        Store per-day counts of the new IPs per group, e.g.
+        {'org': {'Google LLC': 3}, 'country': {...}, 'highlight': {...}}.
+        Without accumulate, the day's previous counts for these dimensions are replaced.
+        """
+        with self.conn:
+            if not accumulate:
+                self.conn.executemany(
+                    "DELETE FROM rollups WHERE day = ? AND dimension = ?",
+                    [(day.isoformat(), dimension) for dimension in groups]
+                )
+        for dimension, counts in groups.items():
+            self._update_rollups(day, dimension, counts, accumulate=True)
+
+    def _update_rollups(self, day, dimension, counts, accumulate):
+        update = "count + excluded.count" if accumulate else "excluded.count"
+        with self.conn:
+            self.conn.executemany(f"""
+                INSERT INTO rollups (day, dimension, key, count) VALUES (?, ?, ?, ?)
+                ON CONFLICT(day, dimension, key) DO UPDATE SET count = {update}
+            """, [(day.isoformat(), dimension, key or '', count) for key, count in counts.items()])
+
+    def write_rollup_summary(self, csv_path):
+        """
+        Write the rollup table as a trend CSV with one (day, dimension, key, count) row per
+        counter. Only the rollups are read, never the sightings, so this costs O(days).
+        """
+        rows = self.conn.execute(
+            "SELECT day, dimension, key, count FROM rollups ORDER BY day, dimension, count DESC, key"
+        ).fetchall()
+
+        with open(csv_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['day', 'dimension', 'key', 'count'])
+            writer.writerows(rows)
+
+        days = len({row[0] for row in rows})
+        print(f"Wrote trend summary for {days} days to {csv_path}")
+        return csv_path
+
+    def day_totals(self):
+        """Return a list of (day, total, new, removed) from the rollup table"""
+        totals = {}
+        for day, key, count in self.conn.execute(
+            "SELECT day, key, count FROM rollups WHERE dimension = 'blocked' ORDER BY day"
+        ):
+            totals.setdefault(day, {})[key] = count
+        return [(day, t.get('total', 0), t.get('new', 0), t.get('removed', 0)) for day, t in totals.items()]
+
+    def lookup(self, ip):
+        """
+        Return a dict with first_seen, last_seen, days_seen and the enrichment fields
+        for ip, or None if it was never blocked
+        """
+        row = self.conn.execute(
+            "SELECT first_seen, last_seen, days_seen FROM summary WHERE ip = ?", (ip,)
+        ).fetchone()
+        if not row:
+            return None
+
+        result = {'ip': ip, 'first_seen': row[0], 'last_seen': row[1], 'days_seen': row[2]}
+        enrichment = self.conn.execute(
+            "SELECT org, country_name, hostname FROM enrichment WHERE ip = ?", (ip,)
+        ).fetchone()
+        if enrichment:
+            result.update(org=enrichment[0], country_name=enrichment[1], hostname=enrichment[2])
+        return result
+
+    def lookup_many(self, ip_list):
+        """Return a dict of ip -> (first_seen, days_seen) for the IPs present in the index"""
+        result = {}
+        for ip in ip_list:
+            row = self.conn.execute(
+                "SELECT first_seen, days_seen FROM summary WHERE ip = ?", (ip,)
+            ).fetchone()
+            if row:
+                result[ip] = row
+        return result
+
+    def dates_for(self, ip):
+        """Return the sorted list of days ip appeared in the blocked set"""
+        return [row[0] for row in self.conn.execute(
+            "SELECT day FROM sightings WHERE ip = ? ORDER BY day", (ip,)
+        )]
+
+
+def main():
+    """Print the blocking history of the IP addresses given on the command line"""
+    if len(sys.argv) < 2:
+        print(f"Usage: python {os.path.basename(sys.argv[0])} <ip> [<ip> ...] [--dates]")
+        print(f"       python {os.path.basename(sys.argv[0])} --trend")
+        return
+
+    if not os.path.exists(HISTORY_DB_PATH):
+        print(f"Error: History index not found at {HISTORY_DB_PATH}")
+        return
+
+    if sys.argv[1] == '--trend':
+        with IPHistoryIndex(HISTORY_DB_PATH) as history:
+            print(f"{'day':<12}{'total':>10}{'new':>10}{'removed':>10}")
+            for day, total, new, removed in history.day_totals():
+                print(f"{day:<12}{total:>10}{new:>10}{removed:>10}")
+        return
+
+    show_dates = '--dates' in sys.argv
+    ips = [arg for arg in sys.argv[1:] if arg != '--dates']
+
+    with IPHistoryIndex(HISTORY_DB_PATH) as history:
+        for ip in ips:
+            start = datetime.datetime.now()
+            result = history.lookup(ip)
+            elapsed_ms = (datetime.datetime.now() - start).total_seconds() * 1000
+
+            if not result:
+                print(f"{ip}: never blocked")
+                continue
+
+            print(f"{ip}: first seen {result['first_seen']}, last seen {result['last_seen']}, "
+                  f"blocked on {result['days_seen']} days ({elapsed_ms:.3f} ms)")
+            if result.get('org'):
+                print(f"  org: {result['org']}, country: {result['country_name']}, hostname: {result['hostname']}")
+            if show_dates:
+                print("  dates: " + ", ".join(history.dates_for(ip)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import functools
+import http.cookiejar
+import urllib.parse
+import urllib.request
+
+import fake_pfsense
+
+# ========== LOAD TEST CONFIGURATION ==========
+# Stages timed in the report: (module name, function or Class.method, stage label).
+# Nested stages are included in the time of the stage that calls them.
+TIMED_STAGES = [
+    ('check_ip', 'login_and_download_blocked_hosts', "download"),
+    ('check_ip', 'refresh_passlist_cache', "pass list read"),
+    ('check_ip', 'load_passlist', "pass list index"),
+    ('check_ip', 'extract_ip_snapshot', "parse archive"),
+    ('check_ip', 'merge_firewall_results', "compare"),
+    ('check_ip', 'process_ip_addresses_from_set', "enrich + report"),
+    ('check_ip', 'fetch_ip_details', "  ipinfo lookups"),
+    ('check_ip', 'write_aggregated_report', "  aggregated sheet"),
+    ('output_sinks', 'ExcelSink.close', "  excel save"),
+    ('extract_ips_from_sheet', 'extract_red_ips_from_newest_sheet', "extract red IPs"),
+    ('extract_ips_from_sheet', 'add_ips_to_passlist', "pass list write"),
+]
+
+
+class StageTimer:
+    """Wrap functions so their calls and wall time are accumulated per stage"""
+
+    def __init__(self):
+        self.stages = {}
+
+    def wrap(self, module, attribute, label):
+        owner = module
+        name = attribute
+        if '.' in attribute:
+            class_name, name = attribute.split('.')
+            owner = getattr(module, class_name)
+        function = getattr(owner, name)
+        self.stages[label] = [0, 0.0]
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                entry = self.stages[label]
+                entry[0] += 1
+                entry[1] += time.perf_counter() - start
+
+        setattr(owner, name, timed)
+
+    def report(self):
+        print(f"{'stage':<24}{'calls':>8}{'seconds':>12}")
+        for label, (calls, seconds) in self.stages.items():
+            if calls:
+                print(f"{label:<24}{calls:>8}{seconds:>12.3f}")
+
+
+def http_download_blocked_hosts(credentials, base_url=None, download_dir=None):
+    """
+    Download the blocked hosts archive with plain HTTP requests instead of a browser
+    (same signature as check_ip.login_and_download_blocked_hosts), for runs without Chrome
+    """
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    page_url = base_url + "snort/snort_blocked.php"
+    login = urllib.parse.urlencode({'usernamefld': credentials['username'],
+                                    'passwordfld': credentials['password'], 'login': 'Sign In'})
+    opener.open(page_url, data=login.encode()).read()
+
+    with opener.open(page_url, data=b"download=1") as response:
+        disposition = response.headers.get('Content-Disposition', '')
+        if 'filename=' not in disposition:
+            print("Download failed: not logged in")
+            return None
+        file_name = disposition.split('filename=')[1].strip('"')
+        os.makedirs(download_dir, exist_ok=True)
+        path = os.path.join(download_dir, file_name)
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(response, f)
+
+    print(f"Download completed: {file_name}")
+    return path
+
+
+def configure(work_dir, server, args):
+    """Point every script at the work directory and the stand-in server"""
+    import ipinfo.handler
+    import check_ip
+    import ip_history
+    import firewall_session
+    import extract_ips_from_sheet
+
+    credentials = {'username': fake_pfsense.USERNAME, 'password': fake_pfsense.PASSWORD}
+    download_dir = os.path.join(work_dir, "downloads")
+    output_dir = os.path.join(work_dir, "output")
+    os.makedirs(output_dir, exist_ok=True)
+
+    check_ip.BASE_URL = server.url
+    check_ip.WEBSITE_CREDENTIALS.update(credentials)
+    check_ip.DOWNLOAD_DIR = download_dir
+    check_ip.OUTPUT_DIR = output_dir
+    check_ip.KNOWN_RANGES_DIR = ""
+    check_ip.IPINFO_ACCESS_TOKEN = "stand-in"
+    check_ip.OUTPUT_FORMATS = args.formats
+    ip_history.HISTORY_DB_PATH = os.path.join(output_dir, "ip_history.db")
+    firewall_session.SESSION_DIR = work_dir
+
+    extract_ips_from_sheet.BASE_URL = server.url
+    extract_ips_from_sheet.WEBSITE_CREDENTIALS.update(credentials)
+    extract_ips_from_sheet.OUTPUT_DIR = output_dir
+    extract_ips_from_sheet.MASTER_XLSX_PATH = os.path.join(output_dir, "master.xlsx")
+
+    # Send the ipinfo client to the stand-in endpoint
+    ipinfo.handler.API_URL = server.ipinfo_url
+
+    if args.no_browser:
+        check_ip.login_and_download_blocked_hosts = http_download_blocked_hosts
+        # Use the stand-in's pass list as the cached copy instead of reading the page
+        check_ip.PASSLIST_REFRESH = False
+        with open(check_ip.get_passlist_cache_path(''), 'w') as f:
+            f.writelines(f"{entry}\n" for entry in server.passlist)
+    return check_ip, extract_ips_from_sheet
+
+
+def run(args):
+    """Run check_ip.py and extract_ips_from_sheet.py end to end against the stand-in"""
+    server = fake_pfsense.FakePfSense(
+        blocked_count=args.blocked, churn=args.churn, ipinfo_latency=args.ipinfo_latency,
+        ipinfo_quota=args.ipinfo_quota, ipinfo_error_rate=args.ipinfo_error_rate,
+        passlist_count=args.passlist
+    ).start()
+    work_dir = tempfile.mkdtemp(prefix="snort_load_test_")
+    print(f"Stand-in server at {server.url}, work directory {work_dir}")
+
+    check_ip, extract_ips = configure(work_dir, server, args)
+    timer = StageTimer()
+    for module_name, attribute, label in TIMED_STAGES:
+        timer.wrap(sys.modules[module_name], attribute, label)
+
+    start = time.perf_counter()
+    try:
+        # === Previous day's archive, so the run below only enriches the churned IPs ===
+        check_ip.login_and_download_blocked_hosts(check_ip.WEBSITE_CREDENTIALS, check_ip.BASE_URL,
+                                                  check_ip.DOWNLOAD_DIR)
+        time.sleep(1)  # Distinct archive timestamps
+
+        # === check_ip.py ===
+        check_ip.main()
+
+        # === extract_ips_from_sheet.py ===
+        success, red_ips, org_name, txt_file_path = extract_ips.extract_red_ips_from_newest_sheet(5)
+        if red_ips and not args.no_browser:
+            extract_ips.add_ips_to_passlist(red_ips[:args.passlist_ips])
+    finally:
+        elapsed = time.perf_counter() - start
+        server.shutdown()
+
+    print("\n" + "=" * 60)
+    print(f"LOAD TEST RESULTS ({args.blocked} blocked IPs, churn {args.churn})")
+    print("=" * 60)
+    timer.report()
+    print(f"{'total':<24}{'':>8}{elapsed:>12.3f}")
+    print("\nStand-in counters: " + ", ".join(f"{key}={value}" for key, value in server.stats.items()))
+    print(f"Pass list entries on the stand-in: {len(server.passlist)}")
+
+    if args.keep:
+        print(f"Output kept in {work_dir}")
+    else:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run both scripts end to end against a local pfSense/ipinfo stand-in and time each stage"
+    )
+    parser.add_argument('--blocked', type=int, default=fake_pfsense.BLOCKED_COUNT, help="IPs in the block table")
+    parser.add_argument('--churn', type=float, default=fake_pfsense.CHURN,
+                        help="Fraction of the block table that is new in the second archive")
+    parser.add_argument('--passlist', type=int, default=fake_pfsense.PASSLIST_COUNT,
+                        help="Initial pass list entries covering blocked hosts")
+    parser.add_argument('--ipinfo-latency', type=float, default=fake_pfsense.IPINFO_LATENCY)
+    parser.add_argument('--ipinfo-quota', type=int, default=fake_pfsense.IPINFO_QUOTA)
+    parser.add_argument('--ipinfo-error-rate', type=float, default=fake_pfsense.IPINFO_ERROR_RATE,
+                        help="Fraction of lookups answered with 429")
+    parser.add_argument('--formats', nargs='+', default=['excel'], help="OUTPUT_FORMATS for check_ip.py")
+    parser.add_argument('--passlist-ips', type=int, default=20, help="Red IPs added to the pass list")
+    parser.add_argument('--no-browser', action='store_true',
+                        help="Download with plain HTTP and skip the pass list step (no Chrome needed)")
+    parser.add_argument('--keep', action='store_true', help="Keep the work directory")
+    return run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
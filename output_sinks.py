@@ -0,0 +1,441 @@
+import os
+import io
+import csv
+import json
+import re
+import time
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+# Excel hard limit is 1,048,576 rows per sheet, one of which is the header
+EXCEL_MAX_ROWS = 1048575
+RED_FILL_COLOR = 'FFFF0000'
+
+# Writers of the master workbook take an advisory lock on '<workbook>.lock' and wait at
+# most this many seconds for another writer; readers never take the lock
+WORKBOOK_LOCK_TIMEOUT = 600
+
+
+class WorkbookLock:
+    """
+    Advisory exclusive lock shared by every process that writes a workbook, held from
+    loading the workbook until the new version has replaced it
+    """
+
+    def __init__(self, path, timeout=None):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.timeout = WORKBOOK_LOCK_TIMEOUT if timeout is None else timeout
+        self.file = None
+
+    def _try_lock(self):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_NBLCK, 1)
+
+    def acquire(self):
+        self.file = open(self.lock_path, 'a+')
+        deadline = time.time() + self.timeout
+        waiting = False
+        while True:
+            try:
+                self._try_lock()
+                return self
+            except OSError:
+                if time.time() >= deadline:
+                    self.file.close()
+                    self.file = None
+                    raise TimeoutError(f"Timed out after {self.timeout} seconds waiting for the lock on {self.path}")
+                if not waiting:
+                    print(f"Waiting for another job to finish writing {self.path}...")
+                    waiting = True
+                time.sleep(0.2)
+
+    def release(self):
+        if self.file is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def save_workbook_atomic(wb, path):
+    """
+    Save wb to a temporary file next to path and atomically replace path with it, so a
+    reader sees either the previous or the new version, never a partly written file.
+    The workbook revision property is incremented on every save.
+    """
+    wb.properties.revision = str(int(wb.properties.revision or 0) + 1)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            wb.save(f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Keep the permissions of the file being replaced (mkstemp creates it as 0600)
+        if os.path.exists(path):
+            os.chmod(temp_path, os.stat(path).st_mode & 0o777)
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp_path, 0o666 & ~umask)
+
+        # On Windows the replace fails while another process has the file open; retry briefly
+        for attempt in range(20):
+            try:
+                os.replace(temp_path, path)
+                break
+            except PermissionError:
+                if attempt == 19:
+                    raise
+                time.sleep(0.5)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return wb.properties.revision
+
+
+def load_workbook_snapshot(path, **kwargs):
+    """
+    Load a consistent version of a workbook without waiting for writers: the file is read
+    into memory through a single open handle, and since writers replace it atomically that
+    handle always refers to one complete version. Returns the openpyxl workbook.
+    """
+    from openpyxl import load_workbook
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    wb = load_workbook(io.BytesIO(data), **kwargs)
+    print(f"Loaded {path} (revision {wb.properties.revision or 0})")
+    return wb
+
+
+class OutputSink:
+    """
+    Base class of the report writers. Rows are written one at a time as enriched
+    records arrive: open(columns) once, write(record) per row, then close().
+    """
+
+    def open(self, columns):
+        self.columns = list(columns)
+
+    def write(self, record):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CsvSink(OutputSink):
+    """Stream rows to a CSV file; appends to an existing file without repeating the header"""
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.append = append
+        self.rows = 0
+
+    def open(self, columns):
+        super().open(columns)
+        write_header = not (self.append and os.path.exists(self.path))
+        self.file = open(self.path, 'a' if self.append else 'w', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=self.columns, extrasaction='ignore')
+        if write_header:
+            self.writer.writeheader()
+
+    def write(self, record):
+        self.writer.writerow(record)
+        self.rows += 1
+
+    def close(self):
+        self.file.close()
+        print(f"Wrote {self.rows} rows to {self.path}")
+
+
+class JsonlSink(OutputSink):
+    """Stream rows to a JSON Lines file, one object per line"""
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.append = append
+        self.rows = 0
+
+    def open(self, columns):
+        super().open(columns)
+        self.file = open(self.path, 'a' if self.append else 'w')
+
+    def write(self, record):
+        self.file.write(json.dumps({column: record.get(column, '') for column in self.columns}) + "\n")
+        self.rows += 1
+
+    def close(self):
+        self.file.close()
+        print(f"Wrote {self.rows} rows to {self.path}")
+
+
+class ParquetSink(OutputSink):
+    """
+    Stream rows to a Parquet file in row groups of batch_size rows (requires pyarrow).
+    Parquet files cannot be appended to, so in append mode each call writes a new part file.
+    """
+
+    def __init__(self, path, append=False, batch_size=50000):
+        if append and os.path.exists(path):
+            base, ext = os.path.splitext(path)
+            part = 2
+            while os.path.exists(f"{base}_part{part}{ext}"):
+                part += 1
+            path = f"{base}_part{part}{ext}"
+        self.path = path
+        self.batch_size = batch_size
+        self.rows = 0
+
+    def open(self, columns):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("pyarrow is required for Parquet output: pip install pyarrow")
+
+        super().open(columns)
+        self._pa = pa
+        self.schema = pa.schema([(column, pa.string()) for column in self.columns])
+        self.writer = pq.ParquetWriter(self.path, self.schema)
+        self.batch = {column: [] for column in self.columns}
+
+    def write(self, record):
+        for column in self.columns:
+            value = record.get(column, '')
+            self.batch[column].append('' if value is None else str(value))
+        self.rows += 1
+        if len(self.batch[self.columns[0]]) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if self.batch[self.columns[0]]:
+            self.writer.write_table(self._pa.table(self.batch, schema=self.schema))
+            self.batch = {column: [] for column in self.columns}
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+        print(f"Wrote {self.rows} rows to {self.path}")
+
+
+class ExcelSink(OutputSink):
+    """
+    Append rows to a date sheet of the master workbook with the usual report formatting:
+    red fill for rows whose org matches highlight_orgs (or whose record sets 'highlight'
+    explicitly), auto-fit columns and a table style.
+    When a sheet reaches max_rows, the rows continue on '<sheet_name>_2', '<sheet_name>_3', ...
+    Rows are spooled to a temporary file as they arrive. close() takes the WorkbookLock,
+    loads the workbook, adds the spooled rows and atomically replaces the file, so the
+    lock is only held for that update and concurrent writers do not lose each other's sheets.
+    openpyxl cannot append to a saved workbook, so that update holds the whole workbook in
+    memory; unlike the other sinks, memory grows with the size of master.xlsx.
+    """
+
+    def __init__(self, master_xlsx_path, sheet_name, highlight_orgs, append=False, max_rows=EXCEL_MAX_ROWS):
+        self.master_xlsx_path = master_xlsx_path
+        self.sheet_name = sheet_name
+        self.highlight_orgs = highlight_orgs
+        self.append = append
+        self.max_rows = max_rows
+        self.rows = 0
+
+    def _shard_name(self, index):
+        return self.sheet_name if index == 1 else f"{self.sheet_name}_{index}"
+
+    def open(self, columns):
+        super().open(columns)
+        self.spool = tempfile.TemporaryFile(mode='w+', encoding='utf-8')
+
+    def write(self, record):
+        # === Highlight rows for selected organizations ===
+        highlight = record.get('highlight')
+        if highlight is None:
+            org = record.get('org')
+            highlight = bool(org and any(target_org in org for target_org in self.highlight_orgs))
+
+        values = [record.get(column, '') for column in self.columns]
+        self.spool.write(json.dumps([highlight, values], default=str) + "\n")
+
+    def close(self):
+        from openpyxl import load_workbook, Workbook
+        from openpyxl.styles import PatternFill
+
+        self.red_fill = PatternFill(start_color=RED_FILL_COLOR, end_color=RED_FILL_COLOR, fill_type='solid')
+        try:
+            # Hold the writer lock from loading the workbook until the new version is in place
+            with WorkbookLock(self.master_xlsx_path):
+                self._load(load_workbook, Workbook)
+                self._append_spooled_rows()
+                self._format_and_save()
+        finally:
+            self.spool.close()
+
+    def _load(self, load_workbook, Workbook):
+        # === Load existing workbook or create new one ===
+        if not os.path.exists(self.master_xlsx_path):
+            self.wb = Workbook()
+            self.default_sheet = self.wb.active
+            print(f"Creating new master file: {self.master_xlsx_path}")
+        else:
+            self.wb = load_workbook(self.master_xlsx_path)
+            self.default_sheet = None
+
+        shard_pattern = re.compile(rf'^{re.escape(self.sheet_name)}(?:_(\d+))?$')
+        existing = sorted(
+            (int(m.group(1) or 1), name) for name in self.wb.sheetnames
+            for m in [shard_pattern.match(name)] if m
+        )
+
+        self.seen_keys = set()
+        self.shard_index = 1
+        self.ws = None
+        if self.append and existing:
+            # Keep the existing rows and continue on the last shard
+            for index, name in existing:
+                ws = self.wb[name]
+                self.seen_keys.update(row[0] for row in ws.iter_rows(min_row=2, max_col=1, values_only=True))
+            self.shard_index, last_name = existing[-1]
+            self.ws = self.wb[last_name]
+            self.ws.tables.clear()
+            # ws.max_row scans every cell, so read it once and count rows from here on
+            self.shard_rows = self.ws.max_row
+            self.shard_widths = {self.shard_index: self._current_widths(self.ws)}
+        else:
+            # Remove sheet if it already exists (optional)
+            for index, name in existing:
+                del self.wb[name]
+
+        if self.ws is None:
+            self.shard_widths = {}
+            self._new_shard()
+
+    def _current_widths(self, ws):
+        from openpyxl.utils import get_column_letter
+
+        return [
+            (ws.column_dimensions[get_column_letter(i)].width or 2) - 2
+            for i in range(1, len(self.columns) + 1)
+        ]
+
+    def _new_shard(self):
+        if self.ws is not None:
+            self.shard_index += 1
+            print(f"Sheet {self.ws.title} reached {self.max_rows} rows, continuing on {self._shard_name(self.shard_index)}")
+        self.ws = self.wb.create_sheet(title=self._shard_name(self.shard_index))
+        self.ws.append(self.columns)
+        self.shard_rows = 1
+        self.shard_widths[self.shard_index] = [len(column) for column in self.columns]
+
+    def _append_spooled_rows(self):
+        self.spool.seek(0)
+        for line in self.spool:
+            highlight, values = json.loads(line)
+
+            # Rows are keyed by the first column (the IP); skip keys already in the sheet
+            key = values[0]
+            if key in self.seen_keys:
+                continue
+            self.seen_keys.add(key)
+
+            if self.shard_rows > self.max_rows:
+                self._new_shard()
+
+            self.ws.append(values)
+            self.shard_rows += 1
+            self.rows += 1
+
+            # === Track column widths for auto-fit ===
+            widths = self.shard_widths[self.shard_index]
+            for i, value in enumerate(values):
+                if value:
+                    widths[i] = max(widths[i], len(str(value)))
+
+            if highlight:
+                for i in range(1, len(values) + 1):
+                    self.ws.cell(row=self.shard_rows, column=i).fill = self.red_fill
+
+    def _format_and_save(self):
+        from openpyxl.utils import get_column_letter
+        from openpyxl.worksheet.table import Table, TableStyleInfo
+
+        for index, widths in self.shard_widths.items():
+            ws = self.wb[self._shard_name(index)]
+
+            # === Auto-fit column widths ===
+            for i, width in enumerate(widths, start=1):
+                ws.column_dimensions[get_column_letter(i)].width = width + 2
+
+            # === Add Excel Table Style with Unique Table Name ===
+            if ws.max_row > 1:  # Only add table if there's data
+                table_ref = f"A1:{get_column_letter(ws.max_column)}{ws.max_row}"
+                table_name = f"IPData_{ws.title.replace('-', '_').replace(':', '_')}"  # Safe table name
+                table = Table(displayName=table_name, ref=table_ref)
+                table.tableStyleInfo = TableStyleInfo(
+                    name="TableStyleMedium6",
+                    showFirstColumn=False,
+                    showLastColumn=False,
+                    showRowStripes=True,
+                    showColumnStripes=False
+                )
+                ws.add_table(table)
+
+        # Remove the default sheet of a new workbook now that it has real sheets
+        if self.default_sheet is not None:
+            self.wb.remove(self.default_sheet)
+
+        # === Save workbook ===
+        revision = save_workbook_atomic(self.wb, self.master_xlsx_path)
+        print(f"Data appended and formatted in: {self.master_xlsx_path}, sheet: {self.sheet_name} "
+              f"({self.rows} rows, {len(self.shard_widths)} sheet(s), revision {revision})")
+
+
+def build_sinks(formats, output_dir, master_xlsx_path, sheet_name, highlight_orgs, append=False):
+    """
+    Create the sinks for the requested output formats ('excel', 'csv', 'jsonl', 'parquet').
+    Non-Excel outputs are written to <output_dir>/blocked_ips_<sheet_name>.<ext>.
+    """
+    sinks = []
+    for output_format in formats:
+        base_path = os.path.join(output_dir, f"blocked_ips_{sheet_name}")
+        if output_format == 'excel':
+            sinks.append(ExcelSink(master_xlsx_path, sheet_name, highlight_orgs, append=append))
+        elif output_format == 'csv':
+            sinks.append(CsvSink(base_path + ".csv", append=append))
+        elif output_format == 'jsonl':
+            sinks.append(JsonlSink(base_path + ".jsonl", append=append))
+        elif output_format == 'parquet':
+            sinks.append(ParquetSink(base_path + ".parquet", append=append))
+        else:
+            raise ValueError(f"Unknown output format: {output_format}")
+    return sinks
@@ -0,0 +1,229 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+# Config file keys and flags map to the module constants of the same name in upper case
+# (e.g. "output_dir" -> OUTPUT_DIR); "username"/"password" fill WEBSITE_CREDENTIALS.
+CONFIG_FLAGS = ['output_dir', 'download_dir', 'base_url', 'username', 'password', 'ipinfo_access_token']
+
+
+def load_config(args):
+    """Merge the JSON config file (if any) with the command line flags; flags win"""
+    config = {}
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+
+    for key in CONFIG_FLAGS:
+        value = getattr(args, key, None)
+        if value is not None:
+            config[key] = value
+    return config
+
+
+def apply_config(module, config):
+    """Override the configuration constants of an imported script module"""
+    for key, value in config.items():
+        if key in ('username', 'password'):
+            # Only the scripts that log in have credentials (not ip_history/firewall_session)
+            if hasattr(module, 'WEBSITE_CREDENTIALS'):
+                module.WEBSITE_CREDENTIALS[key] = value
+        elif hasattr(module, key.upper()):
+            setattr(module, key.upper(), value)
+
+    # Keep paths derived from OUTPUT_DIR consistent
+    if 'output_dir' in config:
+        if hasattr(module, 'MASTER_XLSX_PATH'):
+            module.MASTER_XLSX_PATH = os.path.join(config['output_dir'], "master.xlsx")
+        if hasattr(module, 'HISTORY_DB_PATH'):
+            module.HISTORY_DB_PATH = os.path.join(config['output_dir'], "ip_history.db")
+        if hasattr(module, 'SESSION_DIR') and 'session_dir' not in config:
+            module.SESSION_DIR = config['output_dir']
+    return module
+
+
+def import_check_ip(config):
+    import check_ip
+    import ip_history
+    import firewall_session
+    apply_config(ip_history, config)
+    apply_config(firewall_session, config)
+    return apply_config(check_ip, config)
+
+
+def import_extract_ips(config):
+    import extract_ips_from_sheet
+    import firewall_session
+    apply_config(firewall_session, config)
+    return apply_config(extract_ips_from_sheet, config)
+
+
+def read_ip_list(file_path):
+    """Read one IP address or network per line, skipping blanks and comments"""
+    with open(file_path) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def resolve_archives(check_ip, today, previous):
+    """Default to the latest and previous downloads in DOWNLOAD_DIR when archives are not given"""
+    if not today:
+        today = check_ip.find_latest_download(check_ip.DOWNLOAD_DIR)
+        if not previous:
+            previous = check_ip.find_previous_download(check_ip.DOWNLOAD_DIR, today)
+    return today, previous
+
+
+def new_ips_from_archives(check_ip, today, previous):
+    """Parse both archives and return (today's snapshot, alert stats, set of new IPs)"""
+    today_snapshot, alert_stats = check_ip.extract_ip_snapshot(today, check_ip.OUTPUT_DIR)
+    previous_ips = None
+    if previous:
+        previous_ips = set(check_ip.extract_ip_snapshot(previous, check_ip.OUTPUT_DIR)[0])
+    return today_snapshot, alert_stats, check_ip.compare_ip_sets(set(today_snapshot), previous_ips)
+
+
+def cmd_download(args, config):
+    """Download the blocked hosts archive of every configured firewall"""
+    check_ip = import_check_ip(config)
+    ok = True
+    for firewall in check_ip.get_firewalls():
+        downloaded_file = check_ip.login_and_download_blocked_hosts(
+            firewall['credentials'], base_url=firewall['base_url'], download_dir=firewall['download_dir']
+        )
+        ok = ok and downloaded_file is not None
+    return 0 if ok else 1
+
+
+def cmd_diff(args, config):
+    """Print or save the IPs blocked in the newer archive but not in the older one"""
+    check_ip = import_check_ip(config)
+    today, previous = resolve_archives(check_ip, args.today, args.previous)
+    _, _, new_ips = new_ips_from_archives(check_ip, today, previous)
+
+    lines = sorted(new_ips, key=check_ip.ip_to_int)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.writelines(f"{ip}\n" for ip in lines)
+        print(f"Saved {len(lines)} new IP addresses to: {args.output}")
+    else:
+        for ip in lines:
+            print(ip)
+    return 0
+
+
+def cmd_enrich(args, config):
+    """Enrich new IPs from archives (or a text file) already on disk and write the daily sheet"""
+    check_ip = import_check_ip(config)
+    os.makedirs(check_ip.OUTPUT_DIR, exist_ok=True)
+
+    sheet_name = args.sheet or time.strftime('%d_%m_%Y')
+    extra_columns = {}
+    alert_stats = None
+    if args.ips:
+        new_ips = check_ip.extract_ip_set_from_file(args.ips)
+    else:
+        today, previous = resolve_archives(check_ip, args.today, args.previous)
+        today_snapshot, alert_stats, new_ips = new_ips_from_archives(check_ip, today, previous)
+        extra_columns['interfaces'] = today_snapshot
+
+    # The sheet is rewritten, so it also covers the IPs of earlier runs into it
+    new_ips |= check_ip.get_journal_ips(check_ip.OUTPUT_DIR, sheet_name)
+    if alert_stats is not None:
+        alert_stats = {ip: entry for ip, entry in alert_stats.items() if ip in new_ips}
+    history = check_ip.IPHistoryIndex(os.path.join(check_ip.OUTPUT_DIR, "ip_history.db"))
+    try:
+        success = check_ip.process_ip_addresses_from_set(
+            new_ips, check_ip.OUTPUT_DIR, os.path.join(check_ip.OUTPUT_DIR, "master.xlsx"), sheet_name,
+            known_ranges=check_ip.load_known_ranges(check_ip.KNOWN_RANGES_DIR), history=history,
+            alert_stats=alert_stats, extra_columns=extra_columns,
+            passlist=check_ip.load_passlist(check_ip.get_firewalls())
+        )
+    except TimeoutError as e:
+        print(f"Could not update the master workbook: {e}")
+        success = False
+    finally:
+        history.close()
+    return 0 if success else 1
+
+
+def cmd_report(args, config):
+    """Run the full daily workflow (download, compare, enrich, report), or watch mode"""
+    check_ip = import_check_ip(config)
+    if args.watch:
+        check_ip.watch(args.interval or check_ip.WATCH_INTERVAL)
+    else:
+        check_ip.main()
+    return 0
+
+
+def cmd_extract_red(args, config):
+    """Save the red-highlighted IPs of the newest sheet to a text file"""
+    extract_ips = import_extract_ips(config)
+    os.makedirs(extract_ips.OUTPUT_DIR, exist_ok=True)
+    success, red_ips, org_name, output_path = extract_ips.extract_red_ips_from_newest_sheet(args.org)
+    return 0 if success else 1
+
+
+def cmd_passlist(args, config):
+    """Add the IPs listed in a text file to the Snort Pass List"""
+    extract_ips = import_extract_ips(config)
+    return 0 if extract_ips.add_ips_to_passlist(read_ip_list(args.file)) else 1
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Snort blocked IP analysis. Each subcommand loads only the libraries it needs."
+    )
+    parser.add_argument('--config', help="JSON file with configuration keys (output_dir, download_dir, "
+                                         "base_url, username, password, ipinfo_access_token, firewalls, ...)")
+    parser.add_argument('--output-dir', dest='output_dir')
+    parser.add_argument('--download-dir', dest='download_dir')
+    parser.add_argument('--base-url', dest='base_url')
+    parser.add_argument('--username')
+    parser.add_argument('--password')
+    parser.add_argument('--ipinfo-token', dest='ipinfo_access_token')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    sub = subparsers.add_parser('download', help=cmd_download.__doc__)
+    sub.set_defaults(func=cmd_download)
+
+    sub = subparsers.add_parser('diff', help=cmd_diff.__doc__)
+    sub.add_argument('today', nargs='?', help="Newer archive (default: latest download)")
+    sub.add_argument('previous', nargs='?', help="Older archive (default: previous download)")
+    sub.add_argument('-o', '--output', help="Write the new IPs to this file instead of stdout")
+    sub.set_defaults(func=cmd_diff)
+
+    sub = subparsers.add_parser('enrich', help=cmd_enrich.__doc__)
+    sub.add_argument('--today', help="Newer archive (default: latest download)")
+    sub.add_argument('--previous', help="Older archive (default: previous download)")
+    sub.add_argument('--ips', help="Text file with IPs to enrich instead of diffing archives")
+    sub.add_argument('--sheet', help="Sheet name (default: today's date, dd_mm_yyyy)")
+    sub.set_defaults(func=cmd_enrich)
+
+    sub = subparsers.add_parser('report', help=cmd_report.__doc__)
+    sub.add_argument('--watch', action='store_true', help="Stay resident and poll on a schedule")
+    sub.add_argument('--interval', type=int, help="Seconds between polls in watch mode")
+    sub.set_defaults(func=cmd_report)
+
+    sub = subparsers.add_parser('extract-red', help=cmd_extract_red.__doc__)
+    sub.add_argument('--org', type=int, choices=range(1, 7),
+                     help="1 Google, 2 Microsoft, 3 Amazon, 4 Akamai, 5 all, "
+                          "6 all red networks from the aggregated sheet (default: prompt)")
+    sub.set_defaults(func=cmd_extract_red)
+
+    sub = subparsers.add_parser('passlist', help=cmd_passlist.__doc__)
+    sub.add_argument('file', help="Text file with one IP address per line")
+    sub.set_defaults(func=cmd_passlist)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args, load_config(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())